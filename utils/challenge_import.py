@@ -9,7 +9,10 @@ from django.core.files import File
 from django.db import transaction
 
 from utils.export_challenges import export_keys
-from wargame.models import Challenge, File as ChallengeFile
+from wargame import bundles
+from wargame.models import Challenge, File as ChallengeFile, UserScore
+from wargame.scoreboard import rebuild_scoreboard
+from wargame.storage import file_digest
 from wargame_admin.consumers import MessageType, log
 from wargame_web.settings.base import MEDIA_ROOT
 
@@ -83,6 +86,11 @@ def import_challenge(challenge_dir, challenge_name, dry_run, log_var):
         challenge.save()
         challenge.tags.add(*tags)
         challenge.save()
+        # The flags may have changed, existing submissions have to be checked again
+        challenge.update_submission_correctness()
+        Challenge.update_solve_counts([challenge.id])
+        UserScore.recalculate(challenge.userchallenge_set.values("user_id"))
+        rebuild_scoreboard()
 
     import_files(challenge, files, dry_run, log_var)
 
@@ -90,14 +98,17 @@ def import_challenge(challenge_dir, challenge_name, dry_run, log_var):
 
 
 def import_files(challenge, files, dry_run, log_var):
-    file_entity = challenge.files.all()
-    if file_entity.exists():
-        log(f"Some files already exist, deleting...", log_var, MessageType.WARNING)
-        if not dry_run:
-            file_entity.delete()
+    # Files with the same name, mode, visibility and content are kept, the stored content is shared by the digest
+    existing = {(file.config_name, file.private, file.filename, file.digest): file for file in challenge.files.all()}
+    added = 0
     for file in files:
         filename = os.path.basename(file["path"])
         with open(os.path.join(file["path"]), "rb") as fp:
+            digest = file_digest(fp)
+            if existing.pop((file["conf"], file["private"], filename, digest), None) is not None:
+                continue
+
+            added += 1
             challenge_file = ChallengeFile()
             challenge_file.challenge = challenge
             challenge_file.private = file["private"]
@@ -105,9 +116,19 @@ def import_files(challenge, files, dry_run, log_var):
             challenge_file.config_name = file["conf"]
             challenge_file.filename = filename
             if not dry_run:
-                challenge_file.file.save(filename, File(fp))
+                if not challenge_file.use_stored(digest):
+                    fp.seek(0)
+                    challenge_file.file = File(fp, name=filename)
                 challenge_file.save()
 
+    if existing:
+        log(f"{len(existing)} files were changed or removed, deleting...", log_var, MessageType.WARNING)
+        if not dry_run:
+            ChallengeFile.objects.filter(pk__in=[file.pk for file in existing.values()]).delete()
+    log(f"{added} files added, {len(files) - added} unchanged", log_var, MessageType.INFO)
+    if not dry_run:
+        bundles.schedule_build(challenge.id)
+
 
 def validate_challenge_structure(challenge_path, log_var):
     valid = True
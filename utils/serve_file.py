@@ -1,24 +1,123 @@
 """
-Serves files using Django in debug mode or nginx in production. file_dir is the path of the file relative to the media
-url/root defined in settings. In production, an nginx alias is required from the media url to a location on the file
-system.
+Serves files using nginx in production or Django in debug mode and in deployments without nginx (x_accel_redirect:
+False in the config). file_dir is the path of the file relative to the media url/root defined in settings. With nginx,
+an alias is required from the media url to a location on the file system.
+
+Django streams the file with the same caching and resuming support as nginx: an ETag and Last-Modified header for
+conditional requests, and a single byte range of the file for Range requests. The ETag is the digest of the content if
+the caller knows it. WSGI servers providing wsgi.file_wrapper (e.g. gunicorn) send the file with sendfile.
 """
+import mimetypes
+import os
+import re
 from os.path import join, basename
-from django.http import HttpResponse
-from django.utils.http import urlquote
-from django.views.static import serve
+
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils._os import safe_join
+from django.utils.http import urlquote, http_date, parse_http_date_safe
 from wargame_web.settings import base as settings
 
+STREAM_BLOCK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class FileRange:
+    """A file object reading only the given range of the file, the position of the file is kept for sendfile."""
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def requested_range(request, size, etag, last_modified):
+    """The (start, length) of the requested range, None for the whole file, or False if it can't be satisfied."""
+    match = RANGE_RE.match(request.META.get("HTTP_RANGE", "").strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        # Multiple ranges are allowed to be answered with the whole file
+        return None
+
+    # A range of an outdated copy is answered with the whole file
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != int(last_modified):
+        return None
+
+    start, end = match.groups()
+    if start == "":
+        # The last bytes of the file
+        length = min(int(end), size)
+        return (size - length, length) if length > 0 else False
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+
+def stream_file(request, file_path, etag=None):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, file_path)
+        stat = os.stat(full_path)
+    except (ValueError, FileNotFoundError):
+        raise Http404(f"{file_path} does not exist")
+
+    etag = f'"{etag}"' if etag else file_etag(stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        file_range = requested_range(request, stat.st_size, etag, stat.st_mtime)
+        if file_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+        else:
+            content_type, encoding = mimetypes.guess_type(full_path)
+            file = open(full_path, "rb")
+            if file_range is None:
+                response = FileResponse(file, content_type=content_type or "application/octet-stream")
+                response["Content-Length"] = stat.st_size
+            else:
+                start, length = file_range
+                response = FileResponse(
+                    FileRange(file, start, length), status=206, content_type=content_type or "application/octet-stream"
+                )
+                response["Content-Length"] = length
+                response["Content-Range"] = f"bytes {start}-{start + length - 1}/{stat.st_size}"
+            response.block_size = STREAM_BLOCK_SIZE
+            if encoding:
+                response["Content-Encoding"] = encoding
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    return response
+
 
-def serve_file(request, file_path, display_name=None):
+def serve_file(request, file_path, display_name=None, etag=None):
     if display_name is None:
         display_name = basename(file_path)
 
-    if not settings.DEBUG:
+    if settings.X_ACCEL_REDIRECT:
         response = HttpResponse()
         response["X-Accel-Redirect"] = urlquote(join(settings.MEDIA_URL, file_path).encode("utf-8"))
     else:
-        response = serve(request, join("/", file_path), settings.MEDIA_ROOT)
+        response = stream_file(request, file_path, etag)
 
     response[
         "Content-Disposition"
@@ -22,4 +22,5 @@ admin.site.register(File)
 admin.site.register(Challenge, MarkdownxModelAdmin)
 admin.site.register(UserChallenge)
 admin.site.register(Submission)
+admin.site.register(UserScore)
 admin.site.register(StaffMember)
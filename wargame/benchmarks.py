@@ -0,0 +1,330 @@
+"""
+Benchmarks of the hot paths, run on the test database with generated data. They are not part of the test suite, since
+generating the data takes minutes, and have to be named to run:
+
+    python manage.py test wargame.benchmarks
+"""
+import asyncio
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from wargame import scoreboard, catalog
+from wargame.models import Challenge, User, UserChallenge, Submission, UserScore
+from wargame.tests import WargameSetUp, asgi_get
+from wargame_admin.models import Config, clear_config_snapshot
+from wargame_web.settings import base
+
+
+class BenchmarkSetUp(WargameSetUp):
+    def create_challenges(self, count, points=100):
+        Challenge.objects.bulk_create(
+            Challenge(
+                title=f"Benchmark {i}",
+                description="",
+                level=1,
+                points=points,
+                flag_qpa=f"benchmark-{i}",
+                flag_hacktivity=f"benchmark-{i}",
+                import_name=f"benchmark-{i}",
+            )
+            for i in range(count)
+        )
+        return list(Challenge.objects.filter(import_name__startswith="benchmark-"))
+
+    def create_users(self, count):
+        User.objects.bulk_create(User(username=f"benchmark-{i}") for i in range(count))
+        return list(User.objects.filter(username__startswith="benchmark-").order_by("id"))
+
+    def report(self, name, elapsed):
+        print(f"{type(self).__name__}: {name}: {elapsed * 1000:.1f} ms")
+
+
+class TimelineBenchmark(BenchmarkSetUp, TestCase):
+    teams = 2000
+    submissions = 200000
+    challenges = 50
+    target_ms = 100
+
+    def test_incremental_build(self):
+        mode = Config.objects.config_name().value
+        challenges = self.create_challenges(self.challenges)
+        users = self.create_users(self.teams)
+
+        # Every team attempts every challenge, and solves about half of them with its last submission
+        UserChallenge.objects.bulk_create(
+            UserChallenge(user=user, challenge=challenge, hint_used=random.random() < 0.1)
+            for user in users
+            for challenge in challenges
+        )
+        userchallenges = UserChallenge.objects.filter(user__in=users)
+        attempts = max(self.submissions // (self.teams * self.challenges), 1)
+        Submission.objects.bulk_create(
+            (
+                Submission(
+                    user_challenge=userchallenge,
+                    value=userchallenge.challenge.flag_qpa if solved else f"wrong-{i}",
+                    times=1,
+                    correct_qpa=solved,
+                    correct_hacktivity=solved,
+                )
+                for userchallenge in userchallenges.select_related("challenge")
+                for i, solved in enumerate([False] * (attempts - 1) + [random.random() < 0.5])
+            ),
+            batch_size=5000,
+        )
+        # The solves of a running event happened earlier, they are only re-read until they are surely committed
+        Submission.objects.filter(user_challenge__in=userchallenges).update(
+            creation_dt=F("creation_dt") - timedelta(days=1)
+        )
+        UserScore.recalculate()
+
+        started = time.perf_counter()
+        scoreboard.build_timeline(mode)
+        self.report("full build", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        scoreboard.build_timeline(mode)
+        unchanged_time = time.perf_counter() - started
+        self.report("incremental build without new solves", unchanged_time)
+
+        userchallenge = userchallenges.filter(user=users[0]).exclude(
+            **{f"submission__{Submission.correct_field(mode)}": True}
+        )[0]
+        Submission.get_or_create(userchallenge, userchallenge.challenge.get_flag())
+        started = time.perf_counter()
+        scoreboard.build_timeline(mode)
+        solve_time = time.perf_counter() - started
+        self.report("incremental build after a solve", solve_time)
+
+        self.assertLess(unchanged_time * 1000, self.target_ms)
+        self.assertLess(solve_time * 1000, self.target_ms)
+
+
+class ScoringBenchmark(BenchmarkSetUp, TestCase):
+    challenges = 30
+
+    def test_1000_teams(self):
+        self.benchmark(1000)
+
+    def test_10000_teams(self):
+        self.benchmark(10000)
+
+    def benchmark(self, team_count):
+        """Compares the incremental score update of a solve with dynamic scoring to a full recalculation."""
+        Config.objects.filter(key="scoring_mode").update(value="dynamic")
+        # The value of the challenges has to change with each solve, otherwise the other scores are not updated
+        Config.objects.filter(key="dynamic_decay").update(value=str(team_count))
+        clear_config_snapshot()
+        self.addCleanup(clear_config_snapshot)
+        mode = Config.objects.config_name().value
+
+        challenges = self.create_challenges(self.challenges, points=100000)
+        users = self.create_users(team_count)
+        # Every team except the last one solves about half of the challenges
+        UserChallenge.objects.bulk_create(
+            UserChallenge(user=user, challenge=challenge, hint_used=random.random() < 0.1)
+            for user in users[:-1]
+            for challenge in challenges
+            if random.random() < 0.5
+        )
+        Submission.objects.bulk_create(
+            Submission(
+                user_challenge=userchallenge,
+                value=userchallenge.challenge.flag_qpa,
+                times=1,
+                correct_qpa=True,
+                correct_hacktivity=True,
+            )
+            for userchallenge in UserChallenge.objects.filter(user__in=users).select_related("challenge")
+        )
+
+        started = time.perf_counter()
+        UserScore.recalculate()
+        recalculate_time = time.perf_counter() - started
+        self.report(f"{team_count} teams: full recalculation", recalculate_time)
+
+        userchallenge = UserChallenge.objects.create(user=users[-1], challenge=challenges[0])
+        Submission.get_or_create(userchallenge, challenges[0].get_flag())
+        started = time.perf_counter()
+        UserScore.add_solve(userchallenge)
+        solve_time = time.perf_counter() - started
+        solvers = getattr(Challenge.objects.get(pk=challenges[0].pk), f"solves_{mode}")
+        self.report(f"{team_count} teams: incremental solve updating {solvers} solvers", solve_time)
+
+        self.assertLess(solve_time, recalculate_time)
+
+
+class ChallengeListBenchmark(BenchmarkSetUp, TestCase):
+    submissions = [1000, 10000, 100000, 1000000]
+    challenges = 30
+    repeat = 20
+
+    def test_flat_cost(self):
+        """The challenge list of a user costs the same as the submissions of the other users grow."""
+        challenges = self.create_challenges(self.challenges)
+        user = self.create_users(1)[0]
+        UserChallenge.objects.bulk_create(
+            UserChallenge(user=user, challenge=challenge) for challenge in challenges[::2]
+        )
+        Submission.objects.bulk_create(
+            Submission(
+                user_challenge=userchallenge,
+                value=userchallenge.challenge.flag_qpa,
+                times=1,
+                correct_qpa=True,
+                correct_hacktivity=True,
+            )
+            for userchallenge in UserChallenge.objects.filter(user=user).select_related("challenge")
+        )
+
+        results = []
+        other_count = 0
+        for submission_count in self.submissions:
+            # Every other user solves every challenge, so each of them has one submission per challenge
+            self.add_solvers(challenges, range(other_count, submission_count // self.challenges))
+            other_count = submission_count // self.challenges
+            # The shared catalog is cached, only the level and the solved challenges of the user are queried
+            catalog.challenges_by_level(user)
+
+            started = time.perf_counter()
+            for _ in range(self.repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    levels = catalog.challenges_by_level(user)
+            elapsed = (time.perf_counter() - started) / self.repeat
+            self.report(f"{Submission.objects.count()} submissions: challenge list", elapsed)
+
+            solved = [challenge["solved"] for _, level_challenges in levels for challenge in level_challenges]
+            self.assertEqual(solved.count(True), len(challenges[::2]))
+            results.append((elapsed, len(queries)))
+
+        (smallest, queries), (largest, _) = results[0], results[-1]
+        self.assertEqual({query_count for _, query_count in results}, {queries})
+        # Allows for the noise of the timing, a join with the other users' submissions would grow a thousandfold
+        self.assertLess(largest, smallest * 3 + 0.001)
+
+    def add_solvers(self, challenges, numbers):
+        for batch_start in range(numbers.start, numbers.stop, 1000):
+            User.objects.bulk_create(
+                User(username=f"solver-{i}") for i in range(batch_start, min(batch_start + 1000, numbers.stop))
+            )
+            batch = list(User.objects.filter(username__startswith="solver-", userchallenge=None))
+            UserChallenge.objects.bulk_create(
+                UserChallenge(user=other, challenge=challenge) for other in batch for challenge in challenges
+            )
+            Submission.objects.bulk_create(
+                Submission(
+                    user_challenge=userchallenge,
+                    value=userchallenge.challenge.flag_qpa,
+                    times=1,
+                    correct_qpa=True,
+                    correct_hacktivity=True,
+                )
+                for userchallenge in UserChallenge.objects.filter(user__in=batch).select_related("challenge")
+            )
+
+
+class AsgiBenchmark(BenchmarkSetUp, TransactionTestCase):
+    """
+    Compares the WSGI handler with a fixed pool of worker threads (a synchronous worker process) to the ASGI
+    application, with 500 concurrent clients. Both handlers run in this process, so the network is not measured.
+    """
+
+    # The requests are served by other threads, which only see the committed data
+    serialized_rollback = True
+    clients = 500
+    requests = 5000
+    wsgi_threads = 8
+    paths = ["/scoreboard/", "/challenges/"]
+
+    def test_500_clients(self):
+        self.create_challenges(30)
+        users = self.create_users(1000)
+        UserScore.objects.bulk_create(UserScore(user=user, mode="qpa", total=random.randrange(1000)) for user in users)
+        User.objects.filter(pk=self.user.pk).update(email="user@example.com")
+        self.client.force_login(self.user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+        wsgi = WSGIHandler()
+        for path in self.paths:
+            with ThreadPoolExecutor(max_workers=self.wsgi_threads) as pool:
+
+                async def wsgi_request():
+                    return await asyncio.get_running_loop().run_in_executor(pool, self.wsgi_get, wsgi, path, cookie)
+
+                results, elapsed, _ = asyncio.run(self.run_clients(wsgi_request))
+            self.report_results(f"{path}: WSGI with {self.wsgi_threads} threads", results, elapsed)
+            self.assertEqual({status for status, _ in results}, {200})
+
+            results, elapsed, peak_threads = asyncio.run(self.run_clients(lambda: asgi_get(path, cookie)))
+            self.report_results(f"{path}: ASGI with {base.ASYNC_VIEW_THREADS} threads", results, elapsed)
+            self.assertEqual({status for status, _ in results}, {200})
+            # The pool of the async views, and the thread of the handler running the synchronous middlewares
+            self.assertLessEqual(peak_threads, base.ASYNC_VIEW_THREADS + 1)
+
+    async def run_clients(self, request):
+        """
+        Sends the requests from the concurrent clients. Returns the statuses and latencies, the elapsed time, and the most
+        threads started meanwhile, each of which may hold a database connection.
+        """
+        queue = iter(range(self.requests))
+        results = []
+        baseline = threading.active_count()
+        peak_threads = 0
+
+        async def run_client():
+            nonlocal peak_threads
+            for _ in queue:
+                started = time.perf_counter()
+                status = await request()
+                results.append((status, time.perf_counter() - started))
+                peak_threads = max(peak_threads, threading.active_count() - baseline)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client() for _ in range(self.clients)))
+        return results, time.perf_counter() - started, peak_threads
+
+    @staticmethod
+    def wsgi_get(handler, path, cookie):
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SCRIPT_NAME": "",
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_HOST": "testserver",
+            "HTTP_COOKIE": cookie,
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.url_scheme": "http",
+            "wsgi.version": (1, 0),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        statuses = []
+        response = handler(environ, lambda status, headers: statuses.append(int(status.split()[0])))
+        b"".join(response)
+        response.close()
+        return statuses[0]
+
+    def report_results(self, name, results, elapsed):
+        latencies = sorted(latency for _, latency in results)
+        print(
+            f"{type(self).__name__}: {name}: {len(results) / elapsed:.0f} requests/s, "
+            f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+        )
@@ -0,0 +1,94 @@
+"""
+Zip bundles of the public files of a challenge, one per mode. A bundle is built in the background after the files of
+the challenge change, and is named by the files it contains, so the challenge details page can tell if the bundle of
+the current files is ready without building it. Files that are already compressed are stored without compression,
+which keeps building a bundle about as fast as copying its files.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from wargame import jobs
+from wargame.models import File
+
+BUNDLE_DIR = "challenge-bundles"
+BUILD_DELAY = 2
+BUILD_PENDING_KEY = "wargame:bundles:{}:build-pending"
+
+# Files with these extensions are already compressed
+COMPRESSED_EXTENSIONS = set(
+    ".7z .apk .bz2 .docx .gif .gz .jar .jpeg .jpg .mkv .mp3 .mp4 .png .pptx .rar .tgz .webp .xlsx .xz .zip .zst".split()
+)
+
+
+def bundle_files(challenge_id, config_name):
+    return File.objects.filter(challenge_id=challenge_id, config_name=config_name, private=False).order_by("filename")
+
+
+def bundle_name(challenge_id, config_name, files):
+    """The name of the bundle of the given files in the media directory."""
+    contents = sorted(f"{file.filename}:{file.digest or file.file.name}" for file in files)
+    version = hashlib.sha256("\n".join(contents).encode()).hexdigest()[:32]
+    return posixpath.join(BUNDLE_DIR, f"{challenge_id}-{config_name}-{version}.zip")
+
+
+def bundle_path(challenge_id, config_name, files):
+    """The name of the bundle if it is built, otherwise None."""
+    name = bundle_name(challenge_id, config_name, files)
+    return name if default_storage.exists(name) else None
+
+
+def build_bundle(challenge_id, config_name):
+    files = list(bundle_files(challenge_id, config_name))
+    name = bundle_name(challenge_id, config_name, files)
+    if files and not default_storage.exists(name):
+        os.makedirs(default_storage.path(BUNDLE_DIR), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=default_storage.path(BUNDLE_DIR), prefix=".bundle-")
+        try:
+            with os.fdopen(fd, "wb") as temp, ZipFile(temp, "w") as archive:
+                names = set()
+                for file in files:
+                    if not file.file.storage.exists(file.file.name):
+                        continue
+                    # Files of the same name are numbered
+                    arcname, number = file.filename, 1
+                    while arcname in names:
+                        number += 1
+                        arcname = f"{number}_{file.filename}"
+                    names.add(arcname)
+
+                    compressed = any(file.filename.lower().endswith(extension) for extension in COMPRESSED_EXTENSIONS)
+                    archive.write(file.file.path, arcname, ZIP_STORED if compressed else ZIP_DEFLATED)
+            os.replace(temp_path, default_storage.path(name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # The files may have changed during the build, only the bundle of the current files is kept
+    current = bundle_name(challenge_id, config_name, bundle_files(challenge_id, config_name))
+    _, bundles = default_storage.listdir(BUNDLE_DIR) if default_storage.exists(BUNDLE_DIR) else ([], [])
+    for bundle in bundles:
+        bundle = posixpath.join(BUNDLE_DIR, bundle)
+        if bundle.startswith(posixpath.join(BUNDLE_DIR, f"{challenge_id}-{config_name}-")) and bundle != current:
+            default_storage.delete(bundle)
+
+
+def build_bundles(challenge_id):
+    for config_name, _ in File.CONFIG_CHOICES:
+        build_bundle(challenge_id, config_name)
+
+
+def schedule_build(challenge_id):
+    """Builds the bundles of the challenge once the current transaction is committed."""
+
+    def schedule():
+        # Changes within BUILD_DELAY seconds (e.g. uploading several files) are built together
+        jobs.schedule_once(BUILD_PENDING_KEY.format(challenge_id), BUILD_DELAY, build_bundles, challenge_id)
+
+    transaction.on_commit(schedule)
@@ -0,0 +1,63 @@
+"""
+The challenge catalog shared by every user through the Django cache. It contains the visible challenges grouped by
+level with their tags, and is rebuilt after a challenge or its tags change, or the configuration changes.
+
+The challenge list of a user is the catalog up to the visible level of the user, with the solved challenges marked.
+"""
+from itertools import groupby
+
+from django.core.cache import cache
+
+from wargame.models import Challenge, UserChallenge
+from wargame_admin.models import Config, get_config_version
+
+CATALOG_TTL = 60 * 60
+CATALOG_KEY = "wargame:catalog:{}:{}"
+
+
+def build_catalog():
+    challenges = Challenge.objects.filter(hidden=False).prefetch_related("tags").order_by("level", "title")
+    return [
+        (
+            level,
+            [
+                {
+                    "id": challenge.id,
+                    "title": challenge.title,
+                    "short_description": challenge.short_description,
+                    "tags": [tag.name for tag in challenge.tags.all()],
+                    "points": challenge.current_points(),
+                }
+                for challenge in group
+            ],
+        )
+        for level, group in groupby(challenges, lambda challenge: challenge.level)
+    ]
+
+
+def get_catalog():
+    # The points and the mode of the challenges depend on the configuration
+    key = CATALOG_KEY.format(Challenge.catalog_version(), get_config_version())
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = build_catalog()
+        cache.set(key, catalog, CATALOG_TTL)
+    return catalog
+
+
+def challenges_by_level(user):
+    catalog = get_catalog()
+    if Config.objects.stage_tasks() != 0:
+        level = user.get_visible_level()
+        catalog = [(challenge_level, challenges) for challenge_level, challenges in catalog if challenge_level <= level]
+
+    # Only looks at the user's own submissions, so the cost does not grow with the submissions of other users
+    solved = set(
+        UserChallenge.solved_in_mode(Config.objects.config_name().value)
+        .filter(user=user)
+        .values_list("challenge_id", flat=True)
+    )
+    return [
+        (challenge_level, [dict(challenge, solved=challenge["id"] in solved) for challenge in challenges])
+        for challenge_level, challenges in catalog
+    ]
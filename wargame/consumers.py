@@ -0,0 +1,39 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+
+from wargame.scoreboard import SCOREBOARD_GROUP, get_scoreboard, get_ranks
+from wargame_admin.models import Config
+
+
+class ScoreboardConsumer(WebsocketConsumer):
+    def connect(self):
+        if Config.objects.private_scoreboard() and not self.scope["user"].is_staff:
+            return
+
+        async_to_sync(self.channel_layer.group_add)(SCOREBOARD_GROUP, self.channel_name)
+        self.accept()
+
+        ranks = get_ranks(get_scoreboard()["scores"])
+        self.send(
+            json.dumps({"type": "full", "scores": [{"username": username, **rank} for username, rank in ranks.items()]})
+        )
+
+    def disconnect(self, close_code):
+        async_to_sync(self.channel_layer.group_discard)(SCOREBOARD_GROUP, self.channel_name)
+
+    def receive(self, text_data=None, bytes_data=None):
+        pass
+
+    def scoreboard_update(self, event):
+        self.send(
+            json.dumps(
+                {
+                    "type": "diff",
+                    "changes": event["changes"],
+                    "removed": event["removed"],
+                    "timeline": event["timeline"],
+                }
+            )
+        )
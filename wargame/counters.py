@@ -0,0 +1,100 @@
+"""
+Write-behind counters of repeated wrong submissions. Instead of updating Submission.times on every repeat, the repeats
+are appended to a log in the Django cache, and a background timer adds them to the database every FLUSH_INTERVAL
+seconds with one bulk UPDATE per batch.
+
+The log is split into time slots of FLUSH_INTERVAL seconds. Every slot stores the number of its entries and how many
+of them are already flushed, so any worker can continue flushing the slots of a worker that stopped, and a slot can be
+flushed while new entries are still being appended. The slots of the last BACKLOG_SLOTS intervals are checked on every
+flush, and every slot is flushed when the process exits.
+"""
+import atexit
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+
+from wargame import jobs
+from wargame.models import Submission
+
+FLUSH_INTERVAL = 5
+FLUSH_BATCH_SIZE = 500
+BACKLOG_SLOTS = 120
+SLOT_TTL = FLUSH_INTERVAL * BACKLOG_SLOTS * 2
+FLUSH_LOCK_TIMEOUT = 60
+
+FLUSH_PENDING_KEY = "wargame:submission-times:flush-pending"
+SLOT_COUNT_KEY = "wargame:submission-times:{}:count"
+SLOT_FLUSHED_KEY = "wargame:submission-times:{}:flushed"
+SLOT_LOCK_KEY = "wargame:submission-times:{}:lock"
+ENTRY_KEY = "wargame:submission-times:{}:{}"
+
+
+def current_slot():
+    return int(time.time() // FLUSH_INTERVAL)
+
+
+def add_repeat(userchallenge_id, value):
+    """Counts a repeated submission of the value, the Submission row of the value must already exist."""
+    slot = current_slot()
+    count_key = SLOT_COUNT_KEY.format(slot)
+    cache.add(count_key, 0, SLOT_TTL)
+    index = cache.incr(count_key)
+    cache.set(ENTRY_KEY.format(slot, index), (userchallenge_id, value), SLOT_TTL)
+    schedule_flush()
+
+
+def flush_slot(slot):
+    lock_key = SLOT_LOCK_KEY.format(slot)
+    if not cache.add(lock_key, True, FLUSH_LOCK_TIMEOUT):
+        return
+    try:
+        flushed = cache.get(SLOT_FLUSHED_KEY.format(slot), 0)
+        count = cache.get(SLOT_COUNT_KEY.format(slot), 0)
+        entries = cache.get_many([ENTRY_KEY.format(slot, index) for index in range(flushed + 1, count + 1)])
+
+        repeats = Counter()
+        for index in range(flushed + 1, count + 1):
+            entry = entries.get(ENTRY_KEY.format(slot, index))
+            # The entry may still be written by the worker that reserved it, unless the slot is over
+            if entry is None and slot >= current_slot() - 1:
+                break
+            if entry is not None:
+                repeats[entry] += 1
+            flushed = index
+
+        items = list(repeats.items())
+        with transaction.atomic():
+            for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                batch = items[start : start + FLUSH_BATCH_SIZE]
+                rows = Q()
+                whens = []
+                for (userchallenge_id, value), times in batch:
+                    rows |= Q(user_challenge_id=userchallenge_id, value=value)
+                    whens.append(When(user_challenge_id=userchallenge_id, value=value, then=Value(times)))
+                Submission.objects.filter(rows).update(times=F("times") + Case(*whens, default=Value(0)))
+        cache.set(SLOT_FLUSHED_KEY.format(slot), flushed, SLOT_TTL)
+    finally:
+        cache.delete(lock_key)
+
+
+def flush(slots=BACKLOG_SLOTS):
+    """Adds the buffered repeats of the last slots to the database."""
+    last = current_slot()
+    candidates = range(last - slots, last + 1)
+    counts = cache.get_many([SLOT_COUNT_KEY.format(slot) for slot in candidates])
+    flushed = cache.get_many([SLOT_FLUSHED_KEY.format(slot) for slot in candidates])
+    for slot in candidates:
+        if counts.get(SLOT_COUNT_KEY.format(slot), 0) > flushed.get(SLOT_FLUSHED_KEY.format(slot), 0):
+            flush_slot(slot)
+
+
+def schedule_flush():
+    # Only the first repeat of an interval starts a timer, the flush contains every repeat of the interval. Repeats in
+    # the last second before the flush start another timer, they might be appended after the flush read the log.
+    jobs.schedule_once(FLUSH_PENDING_KEY, FLUSH_INTERVAL, flush, pending=FLUSH_INTERVAL - 1)
+
+
+atexit.register(flush)
@@ -0,0 +1,42 @@
+"""
+Signed download links of challenge files and file bundles. The challenge details page checks the access of the user
+once, and signs a link of each file containing the file and the time it was signed. The signature also covers the
+session cookie of the user, so the link only works in the session it was shown to. The download checks only the
+signature and its age, so it needs no database access before the file is handed to nginx.
+
+A link keeps working until it expires, even if the file is made private or deleted meanwhile.
+"""
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+
+from utils.serve_file import serve_file
+
+LINK_TTL = 60 * 60
+LINK_SALT = "wargame.file_links"
+
+
+def session_salt(request):
+    # The cookie is only part of the key of the signature, it is not included in the link
+    return f"{LINK_SALT}:{request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')}"
+
+
+def signed_url(request, file):
+    return sign(request, file.file.name, file.filename, file.digest, file=file.id)
+
+
+def sign(request, path, filename, digest, **link):
+    """A link to download the file at the path of the media directory as the filename in the session of the request."""
+    token = signing.dumps(
+        {**link, "path": path, "filename": filename, "digest": digest}, salt=session_salt(request), compress=True
+    )
+    return reverse("challenge-file-signed", kwargs={"token": token})
+
+
+def serve_signed(request, token):
+    """
+    Serves the file of the link, raises signing.BadSignature if the link is invalid, expired or was signed in another
+    session.
+    """
+    link = signing.loads(token, salt=session_salt(request), max_age=LINK_TTL)
+    return serve_file(request, link["path"], link["filename"], link.get("digest"))
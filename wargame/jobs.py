@@ -0,0 +1,28 @@
+"""
+Background jobs run by a timer thread of the process after a delay. A job is scheduled at most once per key in the
+Django cache, so the changes of every worker within the delay are handled by a single run. The module only depends on
+Django, so it can be imported by the models of both apps.
+"""
+from threading import Timer
+
+from django.core.cache import cache
+from django.db import connection
+
+
+def run_job(fn, args):
+    try:
+        fn(*args)
+    finally:
+        # The timer thread has its own database connection, which would otherwise leak
+        connection.close()
+
+
+def schedule_once(key, delay, fn, *args, pending=None):
+    """
+    Runs fn(*args) after delay seconds, unless a job of the key is pending. The key stays pending for the given seconds
+    (the delay by default), calls in the meantime are expected to be handled by the scheduled run.
+    """
+    if cache.add(key, True, delay if pending is None else pending):
+        timer = Timer(delay, run_job, [fn, args])
+        timer.daemon = True
+        timer.start()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from wargame.models import UserScore
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the scores and the progress of every user from the submissions"
+
+    def handle(self, *args, **options):
+        UserScore.recalculate()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {UserScore.objects.count()} scores"))
@@ -0,0 +1,103 @@
+import os
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from wargame import bundles
+from wargame.models import File
+from wargame_admin.models import MediaTombstone
+from wargame_web.settings import base
+
+# Files of the media directory which are not referred to by any row
+KEPT_FILES = {"vpn.zip"}
+# Directories of the imports and exports, which are left behind when they crash. The other directories are kept even if
+# they are empty, e.g. exports/ is expected to exist by the error handling of the exports.
+TEMP_DIRECTORIES = ("challenge-temp", "challenge-export-")
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the files of the pending media tombstones, then compares the media directory with the database and "
+        "reports the files no row refers to (e.g. left by crashed imports and exports), and the missing files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delete", action="store_true", help="Delete the unreferenced files")
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=60,
+            help="Minutes since an unreferenced file was changed before it is reported",
+        )
+
+    def handle(self, *args, **options):
+        swept = MediaTombstone.sweep()
+        self.stdout.write(f"{swept} files of tombstones deleted, {MediaTombstone.objects.count()} tombstones left")
+
+        referenced = self.referenced_files()
+        current_bundles = self.current_bundles()
+        on_disk = set()
+        orphans = defaultdict(list)
+        recent = 0
+        changed_before = time.time() - options["min_age"] * 60
+        for root, _, files in os.walk(base.MEDIA_ROOT):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, base.MEDIA_ROOT).replace(os.sep, "/")
+                on_disk.add(name)
+                if name in referenced or name in current_bundles or name in KEPT_FILES:
+                    continue
+                stat = os.stat(path)
+                # The file may belong to an upload, import or export in progress
+                if stat.st_mtime > changed_before:
+                    recent += 1
+                    continue
+                orphans[name.split("/")[0] if "/" in name else "."].append((path, stat.st_size))
+
+        total = 0
+        for directory, files in sorted(orphans.items()):
+            size = sum(size for _, size in files)
+            total += size
+            self.stdout.write(f"{directory}: {len(files)} unreferenced files, {filesizeformat(size)}")
+        self.stdout.write(f"Reclaimable: {filesizeformat(total)} ({recent} recently changed files skipped)")
+
+        missing = referenced - on_disk
+        if missing:
+            self.stdout.write(self.style.WARNING(f"{len(missing)} files referred to by the database are missing:"))
+            for name in sorted(missing):
+                self.stdout.write(f"  {name}")
+
+        if options["delete"]:
+            for files in orphans.values():
+                for path, _ in files:
+                    os.remove(path)
+            # Directories left empty by crashed imports and exports
+            for root, dirs, files in os.walk(base.MEDIA_ROOT, topdown=False):
+                top_directory = os.path.relpath(root, base.MEDIA_ROOT).split(os.sep)[0]
+                if top_directory.startswith(TEMP_DIRECTORIES) and not os.listdir(root):
+                    os.rmdir(root)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {filesizeformat(total)}"))
+
+    @staticmethod
+    def referenced_files():
+        """The names of every file referred to by a row."""
+        referenced = set()
+        for model, field in MediaTombstone.file_fields():
+            for name in model.objects.exclude(**{field.name: ""}).values_list(field.name, flat=True).iterator():
+                if name:
+                    # Failed exports refer to their log by its absolute path
+                    referenced.add(os.path.relpath(name, base.MEDIA_ROOT) if os.path.isabs(name) else name)
+        return referenced
+
+    @staticmethod
+    def current_bundles():
+        """The names of the bundles of the current files of the challenges, which may not be built yet."""
+        files = defaultdict(list)
+        public_files = File.objects.filter(private=False).only(
+            "challenge_id", "config_name", "filename", "digest", "file"
+        )
+        for file in public_files:
+            files[file.challenge_id, file.config_name].append(file)
+        return {bundles.bundle_name(*key, group) for key, group in files.items()}
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wargame.models import Challenge
+
+
+class Command(BaseCommand):
+    help = "Renders the Markdown description of every challenge again, required after the markdownx settings change"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            challenges = list(Challenge.objects.only("id", "description"))
+            for challenge in challenges:
+                challenge.render_description()
+            Challenge.objects.bulk_update(challenges, ["description_html"], batch_size=100)
+        self.stdout.write(self.style.SUCCESS(f"Rendered {len(challenges)} descriptions"))
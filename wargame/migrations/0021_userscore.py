@@ -0,0 +1,56 @@
+# Generated by Django 3.1.14 on 2026-10-18 12:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Sum
+from django.db.models.expressions import ExpressionWrapper
+from django.db.models.functions import Cast
+import django.db.models.deletion
+
+
+def calculate_scores(apps, schema_editor):
+    UserChallenge = apps.get_model("wargame", "UserChallenge")
+    UserScore = apps.get_model("wargame", "UserScore")
+
+    challenge_points = F("challenge__points")
+    hint_used = Cast("hint_used", models.IntegerField())
+    points = ExpressionWrapper(
+        challenge_points - hint_used * (challenge_points / 2), output_field=models.IntegerField()
+    )
+
+    scores = []
+    for mode in ("qpa", "hacktivity"):
+        totals = (
+            UserChallenge.objects.filter(
+                submission__value__iexact=F(f"challenge__flag_{mode}"), challenge__hidden=False
+            )
+            .values("user_id")
+            .annotate(total=Sum(points))
+        )
+        scores += [UserScore(user_id=row["user_id"], mode=mode, total=row["total"]) for row in totals]
+    UserScore.objects.bulk_create(scores)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0020_challenge_hidden")]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserScore",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("mode", models.CharField(choices=[("qpa", "qpa"), ("hacktivity", "hacktivity")], max_length=20)),
+                ("total", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            options={"unique_together": {("user", "mode")}},
+        ),
+        migrations.AddIndex(
+            model_name="userscore", index=models.Index(fields=["mode", "-total"], name="wargame_use_mode_a03445_idx")
+        ),
+        migrations.RunPython(calculate_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:02
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value
+
+
+def update_correctness(apps, schema_editor):
+    Challenge = apps.get_model("wargame", "Challenge")
+    Submission = apps.get_model("wargame", "Submission")
+
+    def correct(flag):
+        if flag is None:
+            return Value(False)
+        return Case(
+            When(value__iexact=flag, then=Value(True)), default=Value(False), output_field=models.BooleanField()
+        )
+
+    for challenge in Challenge.objects.all():
+        Submission.objects.filter(user_challenge__challenge=challenge).update(
+            correct_qpa=correct(challenge.flag_qpa), correct_hacktivity=correct(challenge.flag_hacktivity)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0021_userscore")]
+
+    operations = [
+        migrations.AddField(
+            model_name="submission", name="correct_qpa", field=models.BooleanField(db_index=True, default=False)
+        ),
+        migrations.AddField(
+            model_name="submission", name="correct_hacktivity", field=models.BooleanField(db_index=True, default=False)
+        ),
+        migrations.RunPython(update_correctness, migrations.RunPython.noop),
+    ]
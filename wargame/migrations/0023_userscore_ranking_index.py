@@ -0,0 +1,16 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0022_submission_correct")]
+
+    operations = [
+        migrations.RemoveIndex(model_name="userscore", name="wargame_use_mode_a03445_idx"),
+        migrations.AddIndex(
+            model_name="userscore",
+            index=models.Index(fields=["mode", "-total", "user"], name="wargame_use_mode_637613_idx"),
+        ),
+    ]
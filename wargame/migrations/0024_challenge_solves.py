@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:48
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_solves(apps, schema_editor):
+    Challenge = apps.get_model("wargame", "Challenge")
+    UserChallenge = apps.get_model("wargame", "UserChallenge")
+
+    counts = {}
+    for mode in ("qpa", "hacktivity"):
+        solvers = (
+            UserChallenge.objects.filter(challenge=OuterRef("pk"), **{f"submission__correct_{mode}": True})
+            .values("challenge")
+            .annotate(count=Count("pk", distinct=True))
+            .values("count")
+        )
+        counts[f"solves_{mode}"] = Coalesce(Subquery(solvers), 0)
+    Challenge.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0023_userscore_ranking_index")]
+
+    operations = [
+        migrations.AddField(model_name="challenge", name="solves_qpa", field=models.IntegerField(default=0)),
+        migrations.AddField(model_name="challenge", name="solves_hacktivity", field=models.IntegerField(default=0)),
+        migrations.RunPython(count_solves, migrations.RunPython.noop),
+    ]
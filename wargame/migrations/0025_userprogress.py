@@ -0,0 +1,58 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+
+def calculate_progress(apps, schema_editor):
+    UserChallenge = apps.get_model("wargame", "UserChallenge")
+    UserProgress = apps.get_model("wargame", "UserProgress")
+
+    max_levels = dict(
+        UserChallenge.objects.values("user_id")
+        .annotate(max_level=Max("challenge__level"))
+        .values_list("user_id", "max_level")
+    )
+
+    progress = []
+    for mode in ("qpa", "hacktivity"):
+        solved = UserChallenge.objects.filter(**{f"submission__correct_{mode}": True}, challenge__hidden=False)
+        solved_by_level = {
+            (row["user_id"], row["challenge__level"]): row["count"]
+            for row in solved.values("user_id", "challenge__level").annotate(count=Count("pk", distinct=True))
+        }
+        progress += [
+            UserProgress(
+                user_id=user_id,
+                mode=mode,
+                max_level=max_level,
+                solved_at_max_level=solved_by_level.get((user_id, max_level), 0),
+            )
+            for user_id, max_level in max_levels.items()
+        ]
+    UserProgress.objects.bulk_create(progress)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0024_challenge_solves")]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserProgress",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("mode", models.CharField(choices=[("qpa", "qpa"), ("hacktivity", "hacktivity")], max_length=20)),
+                ("max_level", models.IntegerField(default=1)),
+                ("solved_at_max_level", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+            options={"unique_together": {("user", "mode")}},
+        ),
+        migrations.RunPython(calculate_progress, migrations.RunPython.noop),
+    ]
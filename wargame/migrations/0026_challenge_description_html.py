@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-18 15:40
+
+from django.db import migrations, models
+from markdownx.utils import markdownify
+
+
+def render_descriptions(apps, schema_editor):
+    Challenge = apps.get_model("wargame", "Challenge")
+
+    challenges = list(Challenge.objects.only("id", "description"))
+    for challenge in challenges:
+        challenge.description_html = markdownify(challenge.description)
+    Challenge.objects.bulk_update(challenges, ["description_html"], batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0025_userprogress")]
+
+    operations = [
+        migrations.AddField(
+            model_name="challenge", name="description_html", field=models.TextField(default="", editable=False)
+        ),
+        migrations.RunPython(render_descriptions, migrations.RunPython.noop),
+    ]
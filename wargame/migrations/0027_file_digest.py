@@ -0,0 +1,34 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+import wargame.storage
+
+
+def calculate_digests(apps, schema_editor):
+    File = apps.get_model("wargame", "File")
+
+    # The existing files keep their names, only new files are stored under their digest
+    files = list(File.objects.all())
+    for file in files:
+        if file.file and file.file.storage.exists(file.file.name):
+            with file.file.open("rb") as content:
+                file.digest = wargame.storage.file_digest(content)
+    File.objects.bulk_update(files, ["digest"], batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0026_challenge_description_html")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="file",
+            name="file",
+            field=models.FileField(storage=wargame.storage.ContentAddressedStorage(), upload_to="challenge-files/"),
+        ),
+        migrations.AddField(
+            model_name="file", name="digest", field=models.CharField(default="", editable=False, max_length=64)
+        ),
+        migrations.RunPython(calculate_digests, migrations.RunPython.noop),
+    ]
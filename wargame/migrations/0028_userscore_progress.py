@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:20
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def calculate_progress(apps, schema_editor):
+    UserChallenge = apps.get_model("wargame", "UserChallenge")
+    UserScore = apps.get_model("wargame", "UserScore")
+
+    # The progress counts the solved levels, the attempts of a level are only possible once it is unlocked
+    scores = list(UserScore.objects.all())
+    for mode in ("qpa", "hacktivity"):
+        solved = UserChallenge.objects.filter(**{f"submission__correct_{mode}": True}, challenge__hidden=False)
+        max_levels = dict(
+            solved.values("user_id").annotate(max_level=Max("challenge__level")).values_list("user_id", "max_level")
+        )
+        solved_by_level = {
+            (row["user_id"], row["challenge__level"]): row["count"]
+            for row in solved.values("user_id", "challenge__level").annotate(count=Count("pk", distinct=True))
+        }
+        for score in scores:
+            if score.mode == mode and score.user_id in max_levels:
+                score.max_level = max_levels[score.user_id]
+                score.solved_at_max_level = solved_by_level[(score.user_id, score.max_level)]
+    UserScore.objects.bulk_update(scores, ["max_level", "solved_at_max_level"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame", "0027_file_digest")]
+
+    operations = [
+        migrations.AddField(model_name="userscore", name="max_level", field=models.IntegerField(default=1)),
+        migrations.AddField(model_name="userscore", name="solved_at_max_level", field=models.IntegerField(default=0)),
+        migrations.RunPython(calculate_progress, migrations.RunPython.noop),
+        migrations.DeleteModel(name="UserProgress"),
+    ]
@@ -1,19 +1,57 @@
-import os
+import math
+import uuid
 
 from django.contrib.auth.models import AbstractUser, Permission
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import F, Sum, Max, Q
+from django.db import models, transaction, connection
+from django.db.models import F, Sum, Max, Q, Case, When, Value, Count, OuterRef, Subquery, Exists
 from django.db.models.expressions import ExpressionWrapper
 from django.db.models.fields import IntegerField
 from django.db.models.functions import Coalesce, Cast
 from django.dispatch import receiver
 from markdownx.models import MarkdownxField
+from markdownx.utils import markdownify
 from taggit.managers import TaggableManager
 
 import wargame_web.settings.base as settings
-from wargame_admin.models import Config
+from wargame import jobs
+from wargame.storage import ContentAddressedStorage
+from wargame_admin.models import Config, MediaTombstone
+
+
+# Changed whenever scores are recalculated instead of being updated incrementally
+SCORE_GENERATION_KEY = "wargame:score_generation"
+# Changed whenever the challenge list shown to the users changes
+CATALOG_VERSION_KEY = "wargame:catalog_version"
+# Without dynamic scoring, the solve counters are recounted in the background after a burst of solves
+SOLVE_COUNT_DELAY = 5
+SOLVE_COUNT_PENDING_KEY = "wargame:solve-count:{}:pending"
+
+
+def dynamic_points(points, solves):
+    """Value of a challenge with dynamic scoring, decreasing quadratically from its points to the minimum."""
+    minimum = math.ceil(points * Config.objects.dynamic_minimum_ratio())
+    decay = max(Config.objects.dynamic_decay(), 1)
+    # The first solver gets the full points
+    solves = max(solves - 1, 0)
+    return max(math.ceil(points + (minimum - points) * solves ** 2 / decay ** 2), minimum)
+
+
+def solved_points_expression(mode):
+    """Points of a solved UserChallenge in the given mode, using the hint halves the points of the challenge."""
+    if Config.objects.dynamic_scoring():
+        values = Challenge.objects.only("points", "solves_qpa", "solves_hacktivity")
+        challenge_points = Case(
+            *[When(challenge_id=challenge.id, then=Value(challenge.current_points(mode))) for challenge in values],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    else:
+        challenge_points = F("challenge__points")
+    hint_used = Cast("hint_used", IntegerField())
+    return ExpressionWrapper(challenge_points - hint_used * (challenge_points / 2), output_field=IntegerField())
 
 
 def custom_username_validator(username):
@@ -51,78 +89,28 @@ class User(AbstractUser):
         return "Not active"
 
     def get_score(self):
-        if Config.objects.is_qpa():
-            flag_field = F("challenge__flag_qpa")
-        else:
-            flag_field = F("challenge__flag_hacktivity")
-
-        challenge_points = F("challenge__points")
-        hint_used = Cast("hint_used", IntegerField())
-        user_points = ExpressionWrapper(challenge_points - (hint_used * challenge_points * 0.5), output_field=IntegerField())
-
-        return (
-            UserChallenge.objects.filter(user=self, submission__value__iexact=flag_field, challenge__hidden=False)
-            .annotate(points_with_hint=user_points)
-            .aggregate(total_points=Coalesce(Sum("points_with_hint"), 0))
-            .get("total_points")
-        )
+        score = self.userscore_set.filter(mode=Config.objects.config_name().value).first()
+        if score is None:
+            return 0
+        return score.total
 
     @staticmethod
     def get_top_40_by_score():
-        if Config.objects.is_qpa():
-            flag_field = F("userchallenge__challenge__flag_qpa")
-        else:
-            flag_field = F("userchallenge__challenge__flag_hacktivity")
-
-        challenge_points = F("userchallenge__challenge__points")
-        hint_used = Cast("userchallenge__hint_used", IntegerField())
-        user_points = ExpressionWrapper(challenge_points - (hint_used * challenge_points * 0.5), output_field=IntegerField())
-
         return (
-            User.objects.filter(
-                userchallenge__submission__value__iexact=flag_field, userchallenge__challenge__hidden=False, hidden=False
-            )
-            .values("username")
-            .annotate(total_points=Coalesce(Sum(user_points), 0))
-            .order_by("-total_points")[:40]
+            UserScore.objects.filter(mode=Config.objects.config_name().value, user__hidden=False)
+            .annotate(username=F("user__username"), total_points=F("total"))
+            .values("username", "total_points")
+            .order_by("-total", "user_id")[:40]
         )
 
     def get_visible_level(self):
         if Config.objects.stage_tasks() == 0:
             return Challenge.objects.aggregate(Max("level"))["level__max"]
 
-        if Config.objects.is_qpa():
-            flag_field = F("challenge__flag_qpa")
-        else:
-            flag_field = F("challenge__flag_hacktivity")
-
-        user_max_level = self.userchallenge_set.all().aggregate(max_level=Coalesce(Max("challenge__level"), 1))["max_level"]
-        solved_challenges_at_max_level = UserChallenge.objects.filter(
-            challenge__level=user_max_level, challenge__hidden=False, user=self, submission__value__iexact=flag_field
-        ).count()
-
-        if solved_challenges_at_max_level >= Config.objects.stage_tasks():
-            user_max_level += 1
-
-        return user_max_level
-
-    def get_visible_challenges(self):
-        level = self.get_visible_level()
-
-        if Config.objects.is_qpa():
-            flag_field = F("flag_qpa")
-        else:
-            flag_field = F("flag_hacktivity")
-
-        return (
-            Challenge.objects.filter(level__lte=level, hidden=False)
-            .annotate(
-                solved=Sum(
-                    Cast(Q(userchallenge__submission__value__iexact=flag_field, userchallenge__user=self), IntegerField())
-                )
-            )
-            .order_by("level", "title")
-        )
+        score = self.userscore_set.filter(mode=Config.objects.config_name().value).first()
+        if score is None:
+            return 1
+        return score.unlocked_level(Config.objects.stage_tasks())
 
     def is_challenge_visible(self, challenge):
         return challenge.level <= self.get_visible_level() and not challenge.hidden
@@ -132,6 +120,7 @@ class Challenge(models.Model):
     title = models.CharField(max_length=256)
     creation_dt = models.DateTimeField(auto_now_add=True)
     description = MarkdownxField()
+    description_html = models.TextField(default="", editable=False)
     short_description = models.CharField(max_length=512, default="")
     level = models.IntegerField()
     flag_qpa = models.CharField(max_length=256, null=True, verbose_name="Flag (QPA)")
@@ -143,10 +132,87 @@ class Challenge(models.Model):
     import_name = models.CharField(max_length=64, verbose_name="Internal name", unique=True)
     tags = TaggableManager()
     hidden = models.BooleanField(default=False)
+    solves_qpa = models.IntegerField(default=0)
+    solves_hacktivity = models.IntegerField(default=0)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "description" in update_fields:
+            self.render_description()
+        super().save(*args, **kwargs)
+        Challenge.invalidate_catalog()
+
+    def render_description(self):
+        """Renders the Markdown description once, instead of on every view of the challenge."""
+        self.description_html = markdownify(self.description)
+
+    @staticmethod
+    def invalidate_catalog():
+        # Workers rebuilding the catalog before the commit would cache the old data under the new version
+        transaction.on_commit(lambda: cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None))
+
+    @staticmethod
+    def catalog_version():
+        version = cache.get(CATALOG_VERSION_KEY)
+        if version is None:
+            cache.add(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+            version = cache.get(CATALOG_VERSION_KEY)
+        return version
+
+    def current_points(self, mode=None):
+        if not Config.objects.dynamic_scoring():
+            return self.points
+        if mode is None:
+            mode = Config.objects.config_name().value
+        return dynamic_points(self.points, getattr(self, f"solves_{mode}"))
+
+    def points_with_hint(self, hint_used, mode=None):
+        points = self.current_points(mode)
+        if hint_used:
+            return points - points // 2
+        return points
+
+    @staticmethod
+    def update_solve_counts(challenge_ids=None):
+        """Recounts the solves of the given challenges (or every challenge) in both modes."""
+        challenges = Challenge.objects.all()
+        if challenge_ids is not None:
+            challenges = challenges.filter(pk__in=challenge_ids)
+
+        counts = {}
+        for mode, _ in UserScore.MODE_CHOICES:
+            # Hidden challenges are not counted, like by UserScore.add_solve
+            solvers = (
+                UserChallenge.solved_in_mode(mode)
+                .filter(challenge=OuterRef("pk"))
+                .values("challenge")
+                .annotate(count=Count("pk", distinct=True))
+                .values("count")
+            )
+            counts[f"solves_{mode}"] = Coalesce(Subquery(solvers), 0)
+        with transaction.atomic():
+            # Waits for the solves being counted, so they are committed when the counts are read
+            list(challenges.select_for_update().order_by("pk").values_list("pk"))
+            challenges.update(**counts)
+        Challenge.invalidate_catalog()
+
+    @staticmethod
+    def schedule_solve_count(challenge_id):
+        """Recounts the solves of the challenge after the transaction commits, once for the solves within the delay."""
+        transaction.on_commit(
+            lambda: jobs.schedule_once(
+                SOLVE_COUNT_PENDING_KEY.format(challenge_id),
+                SOLVE_COUNT_DELAY,
+                Challenge.update_solve_counts,
+                [challenge_id],
+                # Solves committed while the recount runs schedule another one
+                pending=SOLVE_COUNT_DELAY - 1,
+            )
+        )
+
     def get_flag(self):
         if Config.objects.is_qpa():
             return self.flag_qpa
@@ -162,8 +228,19 @@ class Challenge(models.Model):
     def users_attempted(self):
         return self.userchallenge_set.count()
 
+    def solver_count(self):
+        """Number of users who solved the challenge in the current mode, read from the solve counters."""
+        return getattr(self, f"solves_{Config.objects.config_name().value}")
+
     def users_solved(self):
-        return self.userchallenge_set.filter(submission__value__iexact=self.get_flag()).count()
+        return self.userchallenge_set.filter(**{f"submission__{Submission.correct_field()}": True}).count()
+
+    def update_submission_correctness(self):
+        """Recomputes the correctness of every submission of the challenge, required after the flags change."""
+        Submission.objects.filter(user_challenge__challenge=self).update(
+            correct_qpa=Submission.correct_expression(self.flag_qpa),
+            correct_hacktivity=Submission.correct_expression(self.flag_hacktivity),
+        )
 
     def hidden_str(self):
         if self.hidden:
@@ -174,19 +251,55 @@ class Challenge(models.Model):
 class File(models.Model):
     CONFIG_CHOICES = (("qpa", "qpa"), ("hacktivity", "hacktivity"))
     challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, related_name="files")
-    file = models.FileField(upload_to="challenge-files/")
+    file = models.FileField(upload_to="challenge-files/", storage=ContentAddressedStorage())
+    digest = models.CharField(max_length=64, default="", editable=False)
     filename = models.CharField(max_length=256)
     display_name = models.CharField(max_length=256)
     private = models.BooleanField(default=False)
     config_name = models.CharField(max_length=20, null=False, blank=False, choices=CONFIG_CHOICES)
 
-
-# Deletes file from filesystem when File object is deleted.
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # The content may already be stored for another file, it must not be swept until the row is committed
+            MediaTombstone.lock(shared=True)
+            # The content is stored before the row, the name of the stored file is its digest
+            if self.file and not self.file._committed:
+                self.file.save(self.file.name, self.file.file, save=False)
+            # Files stored before the content-addressed storage keep the digest calculated by the migration
+            self.digest = ContentAddressedStorage.digest_of(self.file.name) or self.digest
+            super().save(*args, **kwargs)
+
+    def use_stored(self, digest):
+        """
+        Refers to the stored file of the digest without copying it. Returns False if no such file is stored. The row has
+        to be saved in the same transaction, so the file is not swept meanwhile.
+        """
+        MediaTombstone.lock(shared=True)
+        name = self.file.field.generate_filename(self, digest)
+        if not self.file.storage.exists(name):
+            return False
+        self.file.name = name
+        self.digest = digest
+        return True
+
+
+@receiver(models.signals.post_delete, sender=Challenge)
+def invalidate_catalog_on_delete(sender, instance, **kwargs):
+    Challenge.invalidate_catalog()
+
+
+@receiver(models.signals.m2m_changed, sender=Challenge.tags.through)
+def invalidate_catalog_on_tag_change(sender, instance, **kwargs):
+    # The tag table is shared by every tagged model
+    if isinstance(instance, Challenge):
+        Challenge.invalidate_catalog()
+
+
+# Deletes the stored file in the background once the last File referring to it is deleted
 @receiver(models.signals.post_delete, sender=File)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     if instance.file:
-        if os.path.isfile(instance.file.path):
-            os.remove(instance.file.path)
+        MediaTombstone.delete_later(instance.file.name)
 
 
 class UserChallenge(models.Model):
@@ -210,7 +323,13 @@ class UserChallenge(models.Model):
         return ret
 
     def solved(self):
-        return self.submission_set.filter(value__iexact=self.challenge.get_flag()).exists()
+        return self.submission_set.filter(**{Submission.correct_field(): True}).exists()
+
+    @staticmethod
+    def solved_in_mode(mode):
+        return UserChallenge.objects.filter(
+            **{f"submission__{Submission.correct_field(mode)}": True}, challenge__hidden=False
+        )
 
 
 class Submission(models.Model):
@@ -218,6 +337,8 @@ class Submission(models.Model):
     value = models.CharField(max_length=256)
     user_challenge = models.ForeignKey(UserChallenge, on_delete=models.CASCADE)
     times = models.IntegerField(default=0)
+    correct_qpa = models.BooleanField(default=False, db_index=True)
+    correct_hacktivity = models.BooleanField(default=False, db_index=True)
 
     class Meta:
         unique_together = ("user_challenge", "value")
@@ -230,9 +351,179 @@ class Submission(models.Model):
             ret = Submission()
             ret.user_challenge = userchallenge
             ret.value = value
+            ret.correct_qpa = Submission.is_correct(value, userchallenge.challenge.flag_qpa)
+            ret.correct_hacktivity = Submission.is_correct(value, userchallenge.challenge.flag_hacktivity)
             ret.save()
         return ret
 
+    @staticmethod
+    def correct_field(mode=None):
+        """Name of the column storing whether the submission is correct in the given (or the current) mode."""
+        if mode is None:
+            mode = Config.objects.config_name().value
+        return f"correct_{mode}"
+
+    @staticmethod
+    def is_correct(value, flag):
+        return flag is not None and value.lower() == flag.lower()
+
+    @staticmethod
+    def correct_expression(flag):
+        if flag is None:
+            return Value(False)
+        return Case(
+            When(value__iexact=flag, then=Value(True)), default=Value(False), output_field=models.BooleanField()
+        )
+
+
+class UserScore(models.Model):
+    """
+    The total points of a user in a mode, and their progress: the highest level of the challenges they solved, and the
+    number of challenges they solved at that level. Only users with solves have a row.
+    """
+
+    MODE_CHOICES = (("qpa", "qpa"), ("hacktivity", "hacktivity"))
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    total = models.IntegerField(default=0)
+    max_level = models.IntegerField(default=1)
+    solved_at_max_level = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (("user", "mode"),)
+        indexes = [models.Index(fields=["mode", "-total", "user"])]
+
+    def unlocked_level(self, stage_tasks):
+        if self.solved_at_max_level >= stage_tasks:
+            return self.max_level + 1
+        return self.max_level
+
+    @staticmethod
+    def ranking(mode):
+        return UserScore.objects.filter(mode=mode, user__hidden=False).order_by("-total", "user_id")
+
+    @staticmethod
+    def ranks_of(mode, totals):
+        """The rank (1 + the number of users with a higher score) of each given score, using a single query."""
+        totals = sorted(set(totals))
+        counts = UserScore.objects.filter(mode=mode, user__hidden=False).aggregate(
+            **{str(i): Count("pk", filter=Q(total__gt=total)) for i, total in enumerate(totals)}
+        )
+        return {total: counts[str(i)] + 1 for i, total in enumerate(totals)}
+
+    @staticmethod
+    def add_solve(userchallenge):
+        """
+        Adds the points and the level of a newly solved challenge to the user's score in the current mode, using a
+        single statement. With dynamic scoring, the solve is counted right away, and the decreased value of the
+        challenge is also applied to the users who solved it before. Otherwise the solves are recounted in the
+        background. Hidden challenges do not contribute to the scores, and their solves are not counted.
+        """
+        challenge = userchallenge.challenge
+        if challenge.hidden:
+            return
+        mode = Config.objects.config_name().value
+        solves_field = f"solves_{mode}"
+
+        if Config.objects.dynamic_scoring():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {Challenge._meta.db_table} SET {solves_field} = {solves_field} + 1 "
+                    f"WHERE id = %s RETURNING {solves_field}",
+                    [challenge.pk],
+                )
+                solves = cursor.fetchone()[0]
+            setattr(challenge, solves_field, solves)
+            old_value = dynamic_points(challenge.points, solves - 1)
+            new_value = dynamic_points(challenge.points, solves)
+            if old_value != new_value:
+                previous_solvers = (
+                    UserChallenge.solved_in_mode(mode).filter(challenge=challenge).exclude(pk=userchallenge.pk)
+                )
+                hint_solvers = previous_solvers.filter(hint_used=True).values("user_id")
+                delta = new_value - old_value
+                hint_delta = (new_value - new_value // 2) - (old_value - old_value // 2)
+                delta = Case(When(user_id__in=hint_solvers, then=Value(hint_delta)), default=Value(delta))
+                UserScore.objects.filter(mode=mode, user_id__in=previous_solvers.values("user_id")).update(
+                    total=F("total") + delta
+                )
+                # The catalog shows the current value of the challenges
+                Challenge.invalidate_catalog()
+        else:
+            Challenge.schedule_solve_count(challenge.pk)
+
+        # Solves below the highest level do not change the progress, a solve above it starts counting the new level
+        points = challenge.points_with_hint(userchallenge.hint_used, mode)
+        table = UserScore._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (user_id, mode, total, max_level, solved_at_max_level) VALUES (%s, %s, %s, %s, 1)
+                ON CONFLICT (user_id, mode) DO UPDATE SET
+                    total = {table}.total + excluded.total,
+                    solved_at_max_level = CASE
+                        WHEN excluded.max_level > {table}.max_level THEN 1
+                        WHEN excluded.max_level = {table}.max_level THEN {table}.solved_at_max_level + 1
+                        ELSE {table}.solved_at_max_level
+                    END,
+                    max_level = CASE
+                        WHEN excluded.max_level > {table}.max_level THEN excluded.max_level
+                        ELSE {table}.max_level
+                    END
+                """,
+                [userchallenge.user_id, mode, points, challenge.level],
+            )
+
+    @staticmethod
+    def recalculate(user_ids=None, solves_changed=True):
+        """
+        Rebuilds the scores and the progress of the given users (or every user) from their submissions. The rows are
+        updated in place after they are locked, so a solve scored concurrently is either counted here or added to the
+        new row. Data derived from the solves is rebuilt, unless solves_changed is False (e.g. only a hint was
+        revealed).
+        """
+        with transaction.atomic():
+            if user_ids is None:
+                Challenge.update_solve_counts()
+            for mode, _ in UserScore.MODE_CHOICES:
+                solved = UserChallenge.solved_in_mode(mode)
+                scores = UserScore.objects.filter(mode=mode)
+                if user_ids is not None:
+                    solved = solved.filter(user_id__in=user_ids)
+                    scores = scores.filter(user_id__in=user_ids)
+
+                solvers = solved.values_list("user_id", flat=True).distinct()
+                UserScore.objects.bulk_create(
+                    [UserScore(user_id=user_id, mode=mode) for user_id in solvers], ignore_conflicts=True
+                )
+                # Waits for the solves being scored, so they are committed when the totals are read
+                list(scores.select_for_update().order_by("pk").values_list("pk"))
+
+                users_solved = solved.filter(user_id=OuterRef("user_id")).values("user_id")
+                totals = users_solved.annotate(total=Sum(solved_points_expression(mode))).values("total")
+                max_level = users_solved.annotate(max_level=Max("challenge__level")).values("max_level")
+                scores.update(total=Coalesce(Subquery(totals), 0), max_level=Coalesce(Subquery(max_level), 1))
+                solved_at_max_level = (
+                    users_solved.filter(challenge__level=OuterRef("max_level"))
+                    .annotate(count=Count("pk", distinct=True))
+                    .values("count")
+                )
+                scores.update(solved_at_max_level=Coalesce(Subquery(solved_at_max_level), 0))
+                # Users without solves are not ranked
+                scores.exclude(Exists(solved.filter(user_id=OuterRef("user_id")))).delete()
+            if solves_changed:
+                transaction.on_commit(UserScore.bump_generation)
+
+    @staticmethod
+    def bump_generation():
+        cache.add(SCORE_GENERATION_KEY, 0, None)
+        cache.incr(SCORE_GENERATION_KEY)
+
+    @staticmethod
+    def generation():
+        """Data derived incrementally from the solves has to be rebuilt when this value changes."""
+        return cache.get(SCORE_GENERATION_KEY, 0)
+
 
 class StaffMember(models.Model):
     name = models.CharField(max_length=256)
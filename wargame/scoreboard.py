@@ -0,0 +1,206 @@
+"""
+Scoreboard snapshots shared by every worker through the Django cache. A snapshot is served for SCOREBOARD_TTL seconds,
+after that a single worker rebuilds it while the others keep serving the stale copy.
+
+Changes of the scoreboard are pushed to the clients of ScoreboardConsumer. Solves arriving within BROADCAST_INTERVAL
+seconds are coalesced into a single broadcast, which only contains the rows whose rank or score changed, and the new
+score timeline, so the clients do not request it at the same time.
+
+The score timeline is built from the solve events, which are cached and only extended with the solves that happened
+since the last build. The events are rebuilt from scratch after the solves were recalculated. The hints are read when
+the timeline is built, so revealing one keeps the events. Submission ids are allocated before the solve is committed,
+so a solve may become visible after solves with higher ids: each build reads the solves above the highest id which is
+older than SOLVE_COMMIT_DELAY, and skips the ones it already has.
+"""
+import time
+from itertools import accumulate
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db import transaction
+
+from wargame import jobs
+from wargame.models import User, Submission, UserScore, Challenge, UserChallenge
+from wargame_admin.models import Config
+
+SCOREBOARD_TTL = 10
+SCOREBOARD_LOCK_TIMEOUT = 30
+SNAPSHOT_KEY = "wargame:scoreboard:{}"
+LOCK_KEY = "wargame:scoreboard:{}:lock"
+
+SCOREBOARD_GROUP = "scoreboard"
+BROADCAST_INTERVAL = 2
+BROADCAST_PENDING_KEY = "wargame:scoreboard:broadcast-pending"
+BROADCAST_STATE_KEY = "wargame:scoreboard:{}:broadcast-state"
+
+TIMELINE_TEAMS = 10
+TIMELINE_KEY = "wargame:scoreboard:{}:timeline"
+TIMELINE_RESULT_KEY = "wargame:scoreboard:{}:timeline-result"
+# Seconds between the creation and the commit of a solve, including the clock difference of the servers
+SOLVE_COMMIT_DELAY = 60
+
+
+def qpa_points(total_points, multiplier):
+    return int(round(total_points * multiplier, -1))
+
+
+def build_snapshot():
+    mode = Config.objects.config_name().value
+    multiplier = Config.objects.qpa_points_multiplier()
+    scores = []
+    for position, score in enumerate(User.get_top_40_by_score(), start=1):
+        # Tied users share the rank of the first of them, like in the full ranking
+        tied = scores and scores[-1]["total_points"] == score["total_points"]
+        scores.append(
+            {
+                "rank": scores[-1]["rank"] if tied else position,
+                "username": score["username"],
+                "total_points": score["total_points"],
+                "qpa_points": qpa_points(score["total_points"], multiplier),
+            }
+        )
+    snapshot = {"built_at": time.time(), "scores": scores}
+    cache.set(SNAPSHOT_KEY.format(mode), snapshot, None)
+    return snapshot
+
+
+def get_scoreboard():
+    mode = Config.objects.config_name().value
+    snapshot = cache.get(SNAPSHOT_KEY.format(mode))
+    if snapshot is not None and time.time() - snapshot["built_at"] < SCOREBOARD_TTL:
+        return snapshot
+
+    lock_key = LOCK_KEY.format(mode)
+    if cache.add(lock_key, True, SCOREBOARD_LOCK_TIMEOUT):
+        try:
+            return build_snapshot()
+        finally:
+            cache.delete(lock_key)
+
+    # Another worker is rebuilding the snapshot
+    if snapshot is not None:
+        return snapshot
+    return build_snapshot()
+
+
+def get_ranks(scores):
+    return {
+        score["username"]: {
+            "rank": score["rank"],
+            "total_points": score["total_points"],
+            "qpa_points": score["qpa_points"],
+        }
+        for score in scores
+    }
+
+
+def broadcast_changes():
+    if Config.objects.private_scoreboard():
+        return
+
+    mode = Config.objects.config_name().value
+    ranks = get_ranks(build_snapshot()["scores"])
+    previous = cache.get(BROADCAST_STATE_KEY.format(mode), {})
+    cache.set(BROADCAST_STATE_KEY.format(mode), ranks, None)
+
+    changes = [{"username": username, **rank} for username, rank in ranks.items() if previous.get(username) != rank]
+    removed = [username for username in previous if username not in ranks]
+    if changes or removed:
+        async_to_sync(get_channel_layer().group_send)(
+            SCOREBOARD_GROUP,
+            {"type": "scoreboard_update", "changes": changes, "removed": removed, "timeline": build_timeline(mode)},
+        )
+
+
+def schedule_broadcast():
+    # Only the first solve of an interval starts a timer, the broadcast contains every solve of the interval
+    jobs.schedule_once(BROADCAST_PENDING_KEY, BROADCAST_INTERVAL, broadcast_changes)
+
+
+def rebuild_scoreboard():
+    """Rebuilds the snapshot once the scores changed by the current transaction are committed."""
+
+    def rebuild():
+        build_snapshot()
+        schedule_broadcast()
+
+    transaction.on_commit(rebuild)
+
+
+def get_solve_events(mode):
+    """Solves of every visible user as {username: [(timestamp, challenge id), ...]}, extended incrementally."""
+    generation = UserScore.generation()
+    state = cache.get(TIMELINE_KEY.format(mode))
+    if state is None or state["generation"] != generation:
+        # The solves of the ids above committed_id are kept in recent, since solves below them may commit later
+        state = {"generation": generation, "committed_id": 0, "recent": {}, "events": {}}
+
+    solves = (
+        Submission.objects.filter(
+            pk__gt=state["committed_id"],
+            user_challenge__challenge__hidden=False,
+            user_challenge__user__hidden=False,
+            **{Submission.correct_field(mode): True},
+        )
+        .values_list("pk", "user_challenge__user__username", "creation_dt", "user_challenge__challenge_id")
+        .order_by("pk")
+    )
+
+    changed = False
+    for pk, username, creation_dt, challenge_id in solves:
+        if pk not in state["recent"]:
+            state["events"].setdefault(username, []).append((creation_dt.timestamp(), challenge_id))
+            state["recent"][pk] = creation_dt.timestamp()
+            changed = True
+
+    # The solves which are not committed yet were created after this, so their ids are higher
+    committed_before = time.time() - SOLVE_COMMIT_DELAY
+    committed_id = max((pk for pk, created in state["recent"].items() if created < committed_before), default=0)
+    if committed_id > state["committed_id"]:
+        state["committed_id"] = committed_id
+        state["recent"] = {pk: created for pk, created in state["recent"].items() if pk > committed_id}
+        changed = True
+
+    if changed:
+        cache.set(TIMELINE_KEY.format(mode), state, None)
+    return state["events"]
+
+
+def get_timeline():
+    """The cached timeline of the current mode, the broadcasts of the scoreboard changes refresh it."""
+    mode = Config.objects.config_name().value
+    timeline = cache.get(TIMELINE_RESULT_KEY.format(mode))
+    if timeline is None:
+        timeline = build_timeline(mode)
+    return timeline
+
+
+def build_timeline(mode):
+    """Step function of the score of the top teams, as lists of timestamps and cumulative scores."""
+    events = get_solve_events(mode)
+    # With dynamic scoring, the current value of the challenge applies to earlier solves too
+    points = {
+        challenge.id: (challenge.points_with_hint(False, mode), challenge.points_with_hint(True, mode))
+        for challenge in Challenge.objects.only("points", "solves_qpa", "solves_hacktivity")
+    }
+
+    top = [score["username"] for score in get_scoreboard()["scores"][:TIMELINE_TEAMS]]
+    hinted = UserChallenge.objects.filter(user__username__in=top, hint_used=True)
+    hints = set(hinted.values_list("user__username", "challenge_id"))
+
+    teams = []
+    for username in top:
+        solves = sorted(events.get(username, []))
+        teams.append(
+            {
+                "username": username,
+                "timestamps": [timestamp for timestamp, _ in solves],
+                "scores": list(
+                    accumulate(points[challenge_id][(username, challenge_id) in hints] for _, challenge_id in solves)
+                ),
+            }
+        )
+    timeline = {"teams": teams}
+    cache.set(TIMELINE_RESULT_KEY.format(mode), timeline, SCOREBOARD_TTL)
+    return timeline
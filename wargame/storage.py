@@ -0,0 +1,63 @@
+"""
+Content-addressed storage of challenge files. A file is stored under the SHA-256 digest of its content in the upload
+directory, so identical files (e.g. the qpa and hacktivity variant of a file, or a re-imported file) share a single
+copy on the disk. The copy is deleted once no File refers to it.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CHUNK_SIZE = 64 * 1024
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def file_digest(file):
+    """The SHA-256 digest of an open binary file."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    @staticmethod
+    def digest_of(name):
+        """The digest of a stored file, or an empty string if the file was not stored by its content."""
+        digest = posixpath.basename(name or "")
+        return digest if DIGEST_RE.match(digest) else ""
+
+    def get_available_name(self, name, max_length=None):
+        # The name is replaced by the digest when the file is saved, files of the same content share it
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+
+        # The content is hashed while it is copied, and only kept if it isn't stored yet
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.path(directory), prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            name = posixpath.join(directory, digest.hexdigest())
+            if self.exists(name):
+                os.remove(temp_path)
+            else:
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, self.path(name))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
@@ -0,0 +1,121 @@
+"""
+Flag submissions. A correct submission, and the first attempt of a challenge, cost at most 3 statements in one
+transaction:
+
+1. creating the UserChallenge of the user on the first attempt, and locking it, so the solve is only scored once,
+2. inserting the submitted value, or counting it again, unless the challenge is already solved,
+3. adding the points and the level of a solve to the UserScore of the user.
+
+A wrong first attempt also reads the UserChallenge beforehand. Wrong submissions of an attempted challenge do not update
+the database. They are counted by the write-behind counters of wargame.counters, and only insert the row of the value if
+it is new (two statements at most).
+
+The solve counters of the challenges are recounted in the background, except with dynamic scoring, where they decide
+the value of the challenge: the counter is then updated by another statement, and the scores of the previous solvers by
+one more if the value changed.
+
+The statements are counted by wargame.tests.SubmissionTest.
+"""
+from collections import namedtuple
+
+from django.db import transaction, connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from wargame import counters
+from wargame.models import UserChallenge, Submission, UserScore
+from wargame.scoreboard import rebuild_scoreboard
+
+SubmissionResult = namedtuple("SubmissionResult", ["userchallenge", "solved_before", "correct"])
+
+
+def attempts(user, challenge, flag):
+    """The UserChallenge of the user, with whether it was solved and whether the flag was submitted before."""
+    submissions = Submission.objects.filter(user_challenge=OuterRef("pk"))
+    return UserChallenge.objects.filter(user=user, challenge=challenge).annotate(
+        solved_before=Exists(submissions.filter(**{Submission.correct_field(): True})),
+        submitted_before=Exists(submissions.filter(value=flag)),
+    )
+
+
+def locked_userchallenge(user, challenge):
+    """The UserChallenge of the user locked until the end of the transaction, created on the first attempt."""
+    table = UserChallenge._meta.db_table
+    with connection.cursor() as cursor:
+        # Updating the existing row without changing it locks it, and returns its state once the lock is held
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, challenge_id, hint_used) VALUES (%s, %s, %s) "
+            f"ON CONFLICT (user_id, challenge_id) DO UPDATE SET hint_used = {table}.hint_used RETURNING id, hint_used",
+            [user.id, challenge.id, False],
+        )
+        pk, hint_used = cursor.fetchone()
+    return UserChallenge(pk=pk, user=user, challenge=challenge, hint_used=bool(hint_used))
+
+
+def add_submission(userchallenge, challenge, flag):
+    """
+    Inserts the submitted value, or counts it again if it was submitted before. Returns the number of times it was
+    submitted, or None without recording it if the challenge is already solved.
+    """
+    submission = new_submission(userchallenge, challenge, flag, times=1)
+    table = Submission._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (creation_dt, value, user_challenge_id, times, correct_qpa, correct_hacktivity) "
+            f"SELECT %s, %s, %s, 1, %s, %s WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {table} WHERE user_challenge_id = %s AND {Submission.correct_field()}) "
+            f"ON CONFLICT (user_challenge_id, value) DO UPDATE SET times = {table}.times + 1 RETURNING times",
+            [
+                connection.ops.adapt_datetimefield_value(timezone.now()),
+                flag,
+                userchallenge.pk,
+                submission.correct_qpa,
+                submission.correct_hacktivity,
+                userchallenge.pk,
+            ],
+        )
+        row = cursor.fetchone()
+    return None if row is None else row[0]
+
+
+def submit_flag(user, challenge, flag):
+    """
+    Records a flag submitted to the challenge, and scores the solve if it is correct. Nothing is recorded if the user
+    already solved the challenge.
+    """
+    correct = Submission.is_correct(flag, challenge.get_flag())
+    if not correct:
+        userchallenge = attempts(user, challenge, flag).first()
+        if userchallenge is not None:
+            if userchallenge.solved_before:
+                return SubmissionResult(userchallenge, solved_before=True, correct=correct)
+            if not userchallenge.submitted_before:
+                # Concurrent submissions of the same value insert the row once, all of them are counted below
+                Submission.objects.bulk_create(
+                    [new_submission(userchallenge, challenge, flag, times=0)], ignore_conflicts=True
+                )
+            counters.add_repeat(userchallenge.id, flag)
+            return SubmissionResult(userchallenge, solved_before=False, correct=False)
+    return record_submission(user, challenge, flag, correct)
+
+
+def new_submission(userchallenge, challenge, flag, times):
+    return Submission(
+        user_challenge=userchallenge,
+        value=flag,
+        times=times,
+        correct_qpa=Submission.is_correct(flag, challenge.flag_qpa),
+        correct_hacktivity=Submission.is_correct(flag, challenge.flag_hacktivity),
+    )
+
+
+@transaction.atomic
+def record_submission(user, challenge, flag, correct):
+    userchallenge = locked_userchallenge(user, challenge)
+    if add_submission(userchallenge, challenge, flag) is None:
+        return SubmissionResult(userchallenge, solved_before=True, correct=correct)
+
+    if correct:
+        UserScore.add_solve(userchallenge)
+        rebuild_scoreboard()
+    return SubmissionResult(userchallenge, solved_before=False, correct=correct)
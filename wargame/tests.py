@@ -0,0 +1,300 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.http import AsgiHandler
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from wargame import counters, scoreboard
+from wargame.models import Challenge, File, User, UserChallenge, Submission, UserScore
+from wargame.submissions import submit_flag
+from wargame_admin.models import Config, clear_config_snapshot
+from wargame_web import executor
+from wargame_web.routing import application
+
+
+async def asgi_get(path, cookie=""):
+    """The status of a GET request served by the ASGI application."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+    }
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await application(scope)(receive, send)
+    return statuses[0]
+
+
+class WargameSetUp:
+    def setUp(self):
+        cache.clear()
+        clear_config_snapshot()
+        Config.objects.filter(key="wargame_active").update(value="True")
+        Config.objects.filter(key="throttle_rate").update(value="0")
+        clear_config_snapshot()
+        # The scoreboard is pushed, and the wrong submissions and solves are counted by timers outside of the test
+        # transaction
+        for target in (
+            "wargame.scoreboard.schedule_broadcast",
+            "wargame.counters.schedule_flush",
+            "wargame.models.Challenge.schedule_solve_count",
+        ):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.challenge = Challenge.objects.create(
+            title="Challenge",
+            description="Description",
+            level=1,
+            points=100,
+            flag_qpa="SECURITEAM{qpa}",
+            flag_hacktivity="SECURITEAM{hacktivity}",
+            import_name="challenge",
+        )
+        self.user = User.objects.create_user("user", "user@example.com", "password")
+
+    def solve(self, user, challenge, **fields):
+        userchallenge, _ = UserChallenge.objects.get_or_create(user=user, challenge=challenge)
+        return Submission.objects.create(
+            user_challenge=userchallenge,
+            value=challenge.get_flag(),
+            correct_qpa=True,
+            correct_hacktivity=True,
+            **fields,
+        )
+
+
+class WargameTestCase(WargameSetUp, TestCase):
+    pass
+
+
+class ScoreboardTest(WargameTestCase):
+    def test_tied_ranks(self):
+        mode = Config.objects.config_name().value
+        for username, total in (("first", 200), ("second", 200), ("third", 100)):
+            UserScore.objects.create(user=User.objects.create_user(username), mode=mode, total=total)
+
+        ranks = scoreboard.get_ranks(scoreboard.build_snapshot()["scores"])
+        self.assertEqual(
+            {username: rank["rank"] for username, rank in ranks.items()}, {"first": 1, "second": 1, "third": 3}
+        )
+
+
+class SolveEventsTest(WargameTestCase):
+    def test_late_commit(self):
+        mode = Config.objects.config_name().value
+        other = User.objects.create_user("other", "other@example.com", "password")
+        self.solve(self.user, self.challenge, pk=10)
+        self.assertEqual(list(scoreboard.get_solve_events(mode)), ["user"])
+
+        # A solve with a lower id, which was not committed during the previous build
+        self.solve(other, self.challenge, pk=5)
+        events = scoreboard.get_solve_events(mode)
+        self.assertEqual(sorted(events), ["other", "user"])
+        self.assertEqual(len(events["user"]), 1)
+
+
+class HiddenChallengeTest(WargameTestCase):
+    def test_not_scored(self):
+        Challenge.objects.filter(pk=self.challenge.pk).update(hidden=True)
+        self.challenge.refresh_from_db()
+        with mock.patch("wargame.submissions.rebuild_scoreboard"):
+            self.assertTrue(submit_flag(self.user, self.challenge, "SECURITEAM{qpa}").correct)
+
+        self.challenge.refresh_from_db()
+        self.assertEqual(self.challenge.solves_qpa, 0)
+        self.assertEqual(self.user.get_score(), 0)
+
+
+class LevelTest(WargameTestCase):
+    def test_unlocked_level(self):
+        Config.objects.filter(key="stage_tasks").update(value="1")
+        clear_config_snapshot()
+        next_challenge = Challenge.objects.create(
+            title="Next", description="", level=2, points=100, flag_qpa="next", flag_hacktivity="next"
+        )
+        self.assertEqual(self.user.get_visible_level(), 1)
+
+        with mock.patch("wargame.submissions.rebuild_scoreboard"):
+            submit_flag(self.user, self.challenge, self.challenge.get_flag())
+            self.assertEqual(self.user.get_visible_level(), 2)
+            submit_flag(self.user, next_challenge, next_challenge.get_flag())
+        self.assertEqual(self.user.get_visible_level(), 3)
+
+        UserScore.recalculate()
+        self.assertEqual(self.user.get_visible_level(), 3)
+        self.assertEqual(self.user.get_score(), 200)
+
+
+class HintTest(WargameTestCase):
+    def test_timeline(self):
+        mode = Config.objects.config_name().value
+        self.solve(self.user, self.challenge)
+        UserScore.recalculate()
+        self.assertEqual(scoreboard.get_timeline()["teams"][0]["scores"], [100])
+
+        # The hint is read from the attempt, the cached solve events are kept
+        UserChallenge.objects.filter(user=self.user).update(hint_used=True)
+        self.assertEqual(scoreboard.get_timeline()["teams"][0]["scores"], [100])
+        self.assertEqual(scoreboard.build_timeline(mode)["teams"][0]["scores"], [50])
+        self.assertEqual(scoreboard.get_timeline()["teams"][0]["scores"], [50])
+
+    def test_solved_in_other_mode(self):
+        mode = Config.objects.config_name().value
+        other_mode = next(choice for choice, _ in UserScore.MODE_CHOICES if choice != mode)
+        userchallenge = UserChallenge.objects.create(user=self.user, challenge=self.challenge)
+        Submission.objects.create(
+            user_challenge=userchallenge, value="flag", **{Submission.correct_field(other_mode): True}
+        )
+        UserScore.recalculate()
+
+        self.client.force_login(self.user)
+        with mock.patch("wargame.models.transaction.on_commit") as on_commit:
+            self.client.post(reverse("challenge-hint", kwargs={"challenge_id": self.challenge.id}))
+        self.assertEqual(UserScore.objects.get(user=self.user, mode=other_mode).total, 50)
+        self.assertNotIn(mock.call(UserScore.bump_generation), on_commit.call_args_list)
+
+
+class ChallengeDetailsTest(WargameTestCase):
+    def test_queries(self):
+        """
+        The page of a solved challenge with tags and files needs 7 queries: the session, the user, the visible level,
+        the challenge with the attempt of the user, its tags and its files, and the score of the user.
+        """
+        self.solve(self.user, self.challenge)
+        self.challenge.tags.add("web", "crypto")
+        for config_name in ("qpa", "hacktivity"):
+            File.objects.create(
+                challenge=self.challenge,
+                file=f"challenge-files/{config_name}.txt",
+                filename=f"{config_name}.txt",
+                display_name=f"{config_name} file",
+                config_name=config_name,
+            )
+        self.client.force_login(self.user)
+        url = reverse("challenge-details", kwargs={"id": self.challenge.id})
+        # The first request loads the config snapshot
+        self.client.get(url)
+
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertContains(response, "crypto")
+        self.assertContains(response, "qpa file")
+        self.assertNotContains(response, "hacktivity file")
+        self.assertContains(response, "fa-check")
+
+
+class SubmissionTest(WargameSetUp, TransactionTestCase):
+    """Runs without a surrounding transaction, like the requests, so the statements include no savepoints."""
+
+    serialized_rollback = True
+
+    def submit(self, flag, statements, user=None):
+        with mock.patch("wargame.submissions.rebuild_scoreboard"), CaptureQueriesContext(connection) as queries:
+            result = submit_flag(user or self.user, self.challenge, flag)
+        # SQLite starts the transactions with a statement, PostgreSQL does not
+        self.assertEqual(len([query for query in queries if query["sql"] != "BEGIN"]), statements)
+        return result
+
+    def test_statements(self):
+        Config.objects.config_name()
+        self.assertFalse(self.submit("wrong", statements=3).correct)
+        self.submit("other", statements=2)
+        self.submit("other", statements=1)
+        self.assertTrue(self.submit("SECURITEAM{qpa}", statements=3).correct)
+        self.assertTrue(self.submit("SECURITEAM{qpa}", statements=2).solved_before)
+        self.assertEqual(self.user.get_score(), 100)
+
+    def test_dynamic_statements(self):
+        Config.objects.filter(key="scoring_mode").update(value="dynamic")
+        Config.objects.filter(key="dynamic_decay").update(value="1")
+        clear_config_snapshot()
+        Config.objects.config_name()
+        other = User.objects.create_user("other", "other@example.com", "password")
+        # The solve is counted, and the scores of the previous solvers are lowered when the value of the challenge changes
+        self.assertTrue(self.submit("SECURITEAM{qpa}", statements=4, user=other).correct)
+        self.assertTrue(self.submit("SECURITEAM{qpa}", statements=5).correct)
+        self.assertEqual(other.get_score(), self.user.get_score())
+        self.assertLess(self.user.get_score(), 100)
+
+    def test_concurrent(self):
+        """The same flags submitted in parallel are all counted, and the solve is scored once."""
+        count = 100
+
+        def run_parallel(flag):
+            barrier = Barrier(count)
+
+            def submit(_):
+                barrier.wait()
+                try:
+                    return submit_flag(self.user, self.challenge, flag)
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                return list(executor.map(submit, range(count)))
+
+        self.assertEqual([result.correct for result in run_parallel("wrong")], [False] * count)
+        results = run_parallel("SECURITEAM{qpa}")
+        # The repeated wrong submissions are counted by the write-behind counters
+        counters.flush()
+
+        self.assertEqual([result.solved_before for result in results].count(False), 1)
+        self.assertEqual(Submission.objects.get(value="wrong").times, count)
+        self.assertEqual(self.user.get_score(), 100)
+
+
+class AsgiTest(WargameTestCase):
+    def test_async_views(self):
+        """The async views and their middlewares run in the pool of wargame_web.executor under the ASGI handler."""
+        with mock.patch("wargame_web.executor.run_job", side_effect=executor.run_job) as run_job:
+            self.assertEqual(async_to_sync(asgi_get)("/scoreboard/"), 200)
+        # DisableSiteMiddleware, RequireEmailMiddleware and the view
+        self.assertEqual(run_job.call_count, 3)
+        # The synchronous views keep the handler of channels
+        self.assertIsInstance(application({"type": "http", "path": "/rules/"}), AsgiHandler)
+
+
+class SignedLinkTest(WargameTestCase):
+    def test_session(self):
+        File.objects.create(
+            challenge=self.challenge,
+            file="challenge-files/file.txt",
+            filename="file.txt",
+            display_name="file",
+            config_name=Config.objects.config_name().value,
+        )
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("challenge-details", kwargs={"id": self.challenge.id}))
+        url = response.context["view"].files()[0].signed_url
+
+        other = Client()
+        other.force_login(User.objects.create_user("other", "other@example.com", "password"))
+        with mock.patch("utils.serve_file.settings.X_ACCEL_REDIRECT", True):
+            self.assertEqual(self.client.get(url)["X-Accel-Redirect"], "/media/challenge-files/file.txt")
+            # A leaked link does not work in another session
+            self.assertEqual(Client().get(url).status_code, 403)
+            self.assertEqual(other.get(url).status_code, 403)
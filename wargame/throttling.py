@@ -0,0 +1,79 @@
+"""
+Rate limiting of flag submissions and hint reveals with token buckets stored in the Django cache. Every user has a
+bucket of throttle_burst tokens refilled at throttle_rate tokens per minute. Every IP address has a bucket refilled at
+throttle_ip_rate tokens per minute, holding the tokens of a minute, since many users may share an address. A request
+takes a token from both buckets of its user and address.
+
+A bucket is stored as the time it becomes full again, so it fits a single cache key. Concurrent requests of the same
+user may read the same state and both pass, which only matters for the first few requests of a burst.
+
+The buckets of the IP addresses are disabled by default (throttle_ip_rate is 0). Behind a reverse proxy, the server has
+to be told the address of the client (e.g. daphne --proxy-headers) before they are enabled, otherwise every user shares
+the bucket of the proxy.
+"""
+import math
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from wargame_admin.models import Config
+
+BUCKET_KEY = "wargame:throttle:{}"
+THROTTLED_COUNT_KEY = "wargame:throttle:{}:rejected"
+THROTTLED_TOTAL_KEY = "wargame:throttle:rejected"
+
+
+def take_token(bucket, rate, burst):
+    """Takes a token from the bucket. Returns 0 on success, or the seconds until a token is available."""
+    interval = 60 / rate
+    now = time.time()
+    key = BUCKET_KEY.format(bucket)
+    full_at = max(cache.get(key, now), now) + interval
+    wait = full_at - now - burst * interval
+    if wait > 0:
+        return wait
+    cache.set(key, full_at, math.ceil(full_at - now))
+    return 0
+
+
+def count_throttled(user_id):
+    for key in (THROTTLED_COUNT_KEY.format(user_id), THROTTLED_TOTAL_KEY):
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def throttled_counts(user_ids):
+    """The number of throttled requests of the given users."""
+    counts = cache.get_many([THROTTLED_COUNT_KEY.format(user_id) for user_id in user_ids])
+    return {user_id: counts.get(THROTTLED_COUNT_KEY.format(user_id), 0) for user_id in user_ids}
+
+
+def throttled_total():
+    return cache.get(THROTTLED_TOTAL_KEY, 0)
+
+
+def throttle(view):
+    """Rejects the request before the view runs if the user or their IP address ran out of tokens."""
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        waits = [0]
+        rate = Config.objects.throttle_rate()
+        if rate > 0:
+            waits.append(take_token(f"user:{request.user.id}", rate, max(Config.objects.throttle_burst(), 1)))
+        ip_rate = Config.objects.throttle_ip_rate()
+        if ip_rate > 0:
+            # A bucket allowing the request loses its token even if the other one rejects it
+            waits.append(take_token(f"ip:{request.META.get('REMOTE_ADDR')}", ip_rate, max(math.ceil(ip_rate), 1)))
+
+        wait = max(waits)
+        if wait > 0:
+            count_throttled(request.user.id)
+            response = HttpResponse("Too many requests, try again later.", status=429)
+            response["Retry-After"] = math.ceil(wait)
+            return response
+        return view(request, *args, **kwargs)
+
+    return wrapper
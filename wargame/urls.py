@@ -2,14 +2,18 @@ from django.contrib.auth.views import LogoutView, LoginView
 from django.urls import reverse_lazy, path
 from django.views.generic import TemplateView
 
+from wargame_web.executor import async_view
 from . import views
 
 urlpatterns = [
     path("", views.IndexView.as_view(), name="index"),
-    path("challenges/", views.ChallengesView.as_view(), name="challenges"),
-    path("challenges/<int:id>/", views.ChallengeDetailsView.as_view(), name="challenge-details"),
+    path("challenges/", async_view(views.ChallengesView.as_view()), name="challenges"),
+    path("challenges/<int:id>/", async_view(views.ChallengeDetailsView.as_view()), name="challenge-details"),
     path("challenges/<int:challenge_id>/hint", views.reveal_hint, name="challenge-hint"),
-    path("scoreboard/", views.ScoreboardView.as_view(), name="scoreboard"),
+    path("api/challenges/<int:challenge_id>/submit", views.api_submit_flag, name="api-challenge-submit"),
+    path("scoreboard/", async_view(views.ScoreboardView.as_view()), name="scoreboard"),
+    path("scoreboard/all/", views.RankingView.as_view(), name="ranking"),
+    path("scoreboard/timeline", views.scoreboard_timeline, name="scoreboard-timeline"),
     path("rules/", views.RulesView.as_view(), name="rules"),
     path("about_us/", views.AboutUsView.as_view(), name="about-us"),
     path("links/", views.LinksView.as_view(), name="links"),
@@ -24,5 +28,6 @@ urlpatterns = [
     path("vpn/", views.VPNView.as_view(), name="vpn-info"),
     path("vpn/key", views.download_vpn_key, name="vpn-key"),
     path("challenge-files/<int:file_id>", views.download_challenge_file, name="challenge-file"),
+    path("challenge-files/signed/<str:token>", views.download_signed_challenge_file, name="challenge-file-signed"),
     path("user/set-email", views.UserEmailView.as_view(), name="user-set-email"),
 ]
@@ -1,44 +1,72 @@
-import itertools
-
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q, Prefetch, OuterRef, Exists
 from django.db.models.expressions import F
-from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import (
+    HttpResponseRedirect,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    JsonResponse,
+)
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.views.generic import TemplateView, UpdateView
 from django_registration.backends.one_step.views import RegistrationView
 
 from utils.serve_file import serve_file
-from wargame import models
+from wargame import models, catalog, file_links, bundles
 from wargame.forms import UserRegistrationForm
-from wargame.models import Challenge, UserChallenge, Submission, File, User
+from wargame.models import Challenge, UserChallenge, Submission, File, User, UserScore
+from wargame.scoreboard import get_scoreboard, rebuild_scoreboard, get_timeline, qpa_points
+from wargame.submissions import submit_flag
+from wargame.throttling import throttle
 from wargame_admin.models import Config, StaticContent
+from wargame_web.executor import async_view
 
 
 class IndexView(TemplateView):
     template_name = "wargame/index.html"
 
     def index_content(self):
-        return StaticContent.objects.get(key="index_right").html
+        return StaticContent.objects.get_html("index_right")
 
 
 class ChallengesView(LoginRequiredMixin, TemplateView):
     template_name = "wargame/challenges.html"
 
     def challenges_by_level(self):
-        challenges = self.request.user.get_visible_challenges()
-        ret = []
-        for key, values in itertools.groupby(challenges, lambda x: x.level):
-            ret.append((key, list(values)))
-        return ret
+        return catalog.challenges_by_level(self.request.user)
 
 
 class ScoreboardView(TemplateView):
     template_name = "wargame/scoreboard.html"
 
     def scores(self):
-        return models.User.get_top_40_by_score()
+        return get_scoreboard()["scores"]
+
+    def show_qpa_points(self):
+        return Config.objects.show_qpa_points()
+
+    def private_scoreboard(self):
+        return Config.objects.private_scoreboard() and not self.request.user.is_staff
+
+
+class RankingView(TemplateView):
+    template_name = "wargame/ranking.html"
+    page_size = 50
+
+    def after(self):
+        """The (score, user id) key of the last row of the previous page."""
+        try:
+            total, user_id = self.request.GET["after"].split(":")
+            return int(total), int(user_id)
+        except (KeyError, ValueError):
+            return None
 
     def show_qpa_points(self):
         return Config.objects.show_qpa_points()
@@ -46,12 +74,58 @@ class ScoreboardView(TemplateView):
     def private_scoreboard(self):
         return Config.objects.private_scoreboard() and not self.request.user.is_staff
 
+    def own_rank(self, mode):
+        if not self.request.user.is_authenticated:
+            return None
+        score = UserScore.ranking(mode).filter(user=self.request.user).first()
+        if score is None:
+            return None
+        return {"rank": UserScore.ranks_of(mode, [score.total])[score.total], "total_points": score.total}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.private_scoreboard():
+            return context
+
+        mode = Config.objects.config_name().value
+        scores = UserScore.ranking(mode)
+        after = self.after()
+        if after is not None:
+            total, user_id = after
+            scores = scores.filter(Q(total__lt=total) | Q(total=total, user_id__gt=user_id))
+
+        rows = list(scores.values("user_id", "user__username", "total")[: self.page_size + 1])
+        if len(rows) > self.page_size:
+            rows = rows[: self.page_size]
+            context["next_page"] = f"{rows[-1]['total']}:{rows[-1]['user_id']}"
+
+        ranks = UserScore.ranks_of(mode, [row["total"] for row in rows])
+        multiplier = Config.objects.qpa_points_multiplier()
+        context["rows"] = [
+            {
+                "rank": ranks[row["total"]],
+                "username": row["user__username"],
+                "total_points": row["total"],
+                "qpa_points": qpa_points(row["total"], multiplier),
+                "own": row["user_id"] == self.request.user.id,
+            }
+            for row in rows
+        ]
+        context["own_rank"] = self.own_rank(mode)
+        return context
+
+
+def scoreboard_timeline(request):
+    if Config.objects.private_scoreboard() and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(get_timeline())
+
 
 class RulesView(TemplateView):
     template_name = "wargame/rules.html"
 
     def rules_content(self):
-        return StaticContent.objects.get(key="rules").html
+        return StaticContent.objects.get_html("rules")
 
 
 class AboutUsView(TemplateView):
@@ -66,7 +140,7 @@ class LinksView(TemplateView):
     template_name = "wargame/links.html"
 
     def links_content(self):
-        return StaticContent.objects.get(key="links").html
+        return StaticContent.objects.get_html("links")
 
 
 class UserRegistrationView(RegistrationView):
@@ -83,45 +157,66 @@ class UserRegistrationView(RegistrationView):
 class ChallengeDetailsView(LoginRequiredMixin, TemplateView):
     template_name = "wargame/challenge_details.html"
 
+    @cached_property
     def challenge(self):
-        return Challenge.objects.get(pk=self.kwargs["id"])
+        """
+        The challenge with its tags, its public files and the attempt of the user, loaded once per request. The page
+        needs 7 queries together with the session, the user, the visible level and the score of the user (checked by
+        wargame.tests.ChallengeDetailsTest).
+        """
+        files = File.objects.filter(config_name=Config.objects.config_name().value, private=False)
+        attempt = UserChallenge.objects.filter(user=self.request.user, challenge=OuterRef("pk"))
+        return (
+            Challenge.objects.prefetch_related("tags", Prefetch("files", queryset=files, to_attr="public_files"))
+            .annotate(
+                user_hint_used=Exists(attempt.filter(hint_used=True)),
+                user_solved=Exists(attempt.filter(**{f"submission__{Submission.correct_field()}": True})),
+            )
+            .get(pk=self.kwargs["id"])
+        )
 
     def files(self):
-        return self.challenge().get_files().filter(private=False).all()
-
-    def userchallenge(self):
-        return UserChallenge.objects.get(user=self.request.user, challenge=self.challenge())
+        # The access of the user was checked by get, the links are only checked for their signature
+        for file in self.challenge.public_files:
+            file.signed_url = file_links.signed_url(self.request, file)
+        return self.challenge.public_files
+
+    def bundle_url(self):
+        """The link of the zip of every public file, if there are several and the zip is ready."""
+        files = self.challenge.public_files
+        if len(files) < 2:
+            return None
+        mode = Config.objects.config_name().value
+        path = bundles.bundle_path(self.challenge.id, mode, files)
+        if path is None:
+            # The zip is built in the background, the files are listed one by one until it is ready
+            bundles.schedule_build(self.challenge.id)
+            return None
+        return file_links.sign(self.request, path, f"{self.challenge.title}.zip", None, challenge=self.challenge.id)
 
     def hint_used(self):
-        if self.userchallenge() is None:
-            return False
-        return self.userchallenge().hint_used
+        return self.challenge.user_hint_used
 
     def solved(self):
-        if self.userchallenge() is None:
-            return False
-        return self.userchallenge().solved()
+        return self.challenge.user_solved
 
     def get(self, request, *args, **kwargs):
-        if not self.request.user.is_challenge_visible(self.challenge()):
+        if not self.request.user.is_challenge_visible(self.challenge):
             return HttpResponseRedirect(reverse_lazy("challenges"))
         return super(ChallengeDetailsView, self).get(request, args, kwargs)
 
+    @method_decorator(throttle)
     def post(self, *args, **kwargs):
-        userchallenge = UserChallenge.get_or_create(self.request.user, self.challenge())
-        if userchallenge.solved():
-            return HttpResponseRedirect(self.request.path)
-
         flag = self.request.POST.get("flag")
 
         if flag is None:
             return HttpResponseRedirect(self.request.path)
 
-        submission = Submission.get_or_create(userchallenge, flag)
-        submission.times += 1
-        submission.save()
+        result = submit_flag(self.request.user, Challenge.objects.get(pk=self.kwargs["id"]), flag)
+        if result.solved_before:
+            return HttpResponseRedirect(self.request.path)
 
-        if userchallenge.solved():
+        if result.correct:
             messages.success(self.request, "Congratulations! You have successfully solved this challenge!")
         else:
             messages.error(self.request, "Your answer was incorrect. Try again!")
@@ -130,6 +225,8 @@ class ChallengeDetailsView(LoginRequiredMixin, TemplateView):
 
 
 @login_required()
+@throttle
+@transaction.atomic
 def reveal_hint(request, challenge_id):
     if request.method != "POST":
         return HttpResponseBadRequest()
@@ -139,14 +236,44 @@ def reveal_hint(request, challenge_id):
     if not userchallenge.solved():
         userchallenge.hint_used = True
         userchallenge.save()
+        # The challenge may be solved in the other mode, where the hint lowers the score
+        if userchallenge.submission_set.filter(Q(correct_qpa=True) | Q(correct_hacktivity=True)).exists():
+            UserScore.recalculate([request.user.id], solves_changed=False)
+            rebuild_scoreboard()
     return HttpResponseRedirect(reverse_lazy("challenge-details", kwargs={"id": challenge_id}))
 
 
+@throttle
+def submit_flag_response(request, challenge_id):
+    challenge = Challenge.objects.filter(pk=challenge_id).first()
+    if challenge is None or not request.user.is_challenge_visible(challenge):
+        return JsonResponse({"error": "Challenge not found"}, status=404)
+
+    flag = request.POST.get("flag")
+    if flag is None:
+        return JsonResponse({"error": "Missing flag"}, status=400)
+
+    result = submit_flag(request.user, challenge, flag)
+    solved = result.solved_before or result.correct
+    points = challenge.points_with_hint(result.userchallenge.hint_used) if solved else 0
+    return JsonResponse({"correct": result.correct, "solved": solved, "points": points})
+
+
+@async_view
+def api_submit_flag(request, challenge_id):
+    """Flag submission answering {correct, solved, points}, without the redirect and the render of the form post."""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Login required"}, status=401)
+    return submit_flag_response(request, challenge_id)
+
+
 class VPNView(LoginRequiredMixin, TemplateView):
     template_name = "wargame/vpn.html"
 
     def vpn_content(self):
-        return StaticContent.objects.get(key="vpn").html
+        return StaticContent.objects.get_html("vpn")
 
 
 @login_required()
@@ -154,15 +281,25 @@ def download_vpn_key(request):
     return serve_file(request, "vpn.zip")
 
 
+@async_view
 @login_required()
 def download_challenge_file(request, file_id):
-    file = File.objects.get(pk=file_id)
+    file = File.objects.select_related("challenge").get(pk=file_id)
 
     if not request.user.is_staff:
         if file.private or not request.user.is_challenge_visible(file.challenge):
             return HttpResponseForbidden()
 
-    return serve_file(request, file.file.name, file.filename)
+    return serve_file(request, file.file.name, file.filename, file.digest)
+
+
+def download_signed_challenge_file(request, token):
+    try:
+        return file_links.serve_signed(request, token)
+    except signing.SignatureExpired:
+        return HttpResponseForbidden("The download link has expired, reload the page of the challenge.")
+    except signing.BadSignature:
+        return HttpResponseForbidden()
 
 
 class UserEmailView(LoginRequiredMixin, UpdateView):
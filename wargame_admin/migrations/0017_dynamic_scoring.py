@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 13:40
+
+from django.db import migrations
+
+
+def update_config(apps, schema_editor):
+    Config = apps.get_model("wargame_admin", "Config")
+
+    scoring_mode = Config(
+        key="scoring_mode",
+        value="static",
+        display_name="Scoring mode",
+        description="With dynamic scoring, the points of a challenge decrease as more users solve it",
+        possible_values='["static", "dynamic"]',
+    )
+    scoring_mode.save()
+
+    minimum_ratio = Config(
+        key="dynamic_minimum_ratio",
+        value="0.25",
+        display_name="Dynamic scoring minimum",
+        description="The ratio of its points a challenge is worth after it was solved by many users",
+    )
+    minimum_ratio.save()
+
+    decay = Config(
+        key="dynamic_decay",
+        value="50",
+        display_name="Dynamic scoring decay",
+        description="The number of solves after which a challenge reaches its minimum value",
+    )
+    decay.save()
+
+
+class Migration(migrations.Migration):
+    dependencies = [("wargame_admin", "0016_auto_20201004_2112")]
+
+    operations = [migrations.RunPython(update_config)]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:10
+
+from django.db import migrations
+
+
+def update_config(apps, schema_editor):
+    Config = apps.get_model("wargame_admin", "Config")
+
+    rate = Config(
+        key="throttle_rate",
+        value="10",
+        display_name="Submission rate limit",
+        description="The number of flag submissions and hint reveals allowed per minute for a user, 0 disables the limit",
+    )
+    rate.save()
+
+    burst = Config(
+        key="throttle_burst",
+        value="5",
+        display_name="Submission burst limit",
+        description="The number of flag submissions and hint reveals a user can make at once before the rate limit "
+        "applies",
+    )
+    burst.save()
+
+    # Behind a proxy which doesn't pass the client address, every user would share a single bucket
+    ip_rate = Config(
+        key="throttle_ip_rate",
+        value="0",
+        display_name="Submission rate limit per IP address",
+        description="The number of flag submissions and hint reveals allowed per minute from an IP address shared by "
+        "the users behind it, 0 disables the limit. Requires the server to know the address of the client",
+    )
+    ip_rate.save()
+
+
+class Migration(migrations.Migration):
+    dependencies = [("wargame_admin", "0017_dynamic_scoring")]
+
+    operations = [migrations.RunPython(update_config)]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("wargame_admin", "0018_throttling")]
+
+    operations = [
+        migrations.CreateModel(
+            name="MediaTombstone",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=255)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
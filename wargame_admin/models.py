@@ -1,41 +1,133 @@
 import json
-import os
+import threading
+import time
+import uuid
 from fractions import Fraction
 
 from chunked_upload.models import ChunkedUpload
-from django.db import models
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import models, transaction, connection
 from django.db.models import Model, CharField, Manager, TextField, signals
 # noinspection PyMethodMayBeStatic
 from django.dispatch import receiver
 
+# Only depends on Django, wargame.models can't be imported here since it imports this module
+from wargame import jobs
+
+
+# The version stamp lives in the shared cache, so a change made by one worker invalidates the snapshot of every worker.
+CONFIG_VERSION_KEY = "wargame_admin:config_version"
+# Seconds between version stamp checks, this is the upper bound on how long a worker can see outdated config values.
+CONFIG_VERSION_CHECK_INTERVAL = 5
+
+
+class ConfigSnapshot:
+    """In-memory copy of every Config row, loaded with a single query and shared by the whole process."""
+
+    def __init__(self, version, configs):
+        self.version = version
+        self.configs = {config.key: config for config in configs}
+        self.checked_at = time.monotonic()
+
+    def get(self, key):
+        try:
+            return self.configs[key]
+        except KeyError:
+            raise Config.DoesNotExist(f"Config {key} does not exist")
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_config_version():
+    version = cache.get(CONFIG_VERSION_KEY)
+    if version is None:
+        # The stamp was evicted or never set, agree on a new one with the other workers
+        cache.add(CONFIG_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(CONFIG_VERSION_KEY)
+    return version
+
+
+def clear_config_snapshot():
+    """Drops the snapshot of this process, the next access reloads it from the database."""
+    global _snapshot
+    _snapshot = None
+
+
+def bump_config_version():
+    def bump():
+        cache.set(CONFIG_VERSION_KEY, uuid.uuid4().hex, None)
+        clear_config_snapshot()
+
+    # Other workers must not reload the snapshot before the new values are visible to them
+    transaction.on_commit(bump)
+
 
 class ConfigManager(Manager):
+    def snapshot(self):
+        global _snapshot
+        snapshot = _snapshot
+        if snapshot is not None and time.monotonic() - snapshot.checked_at < CONFIG_VERSION_CHECK_INTERVAL:
+            return snapshot
+
+        with _snapshot_lock:
+            version = get_config_version()
+            if _snapshot is not None and _snapshot.version == version:
+                _snapshot.checked_at = time.monotonic()
+            else:
+                _snapshot = ConfigSnapshot(version, self.get_queryset().all())
+            return _snapshot
+
+    def get_cached(self, key):
+        return self.snapshot().get(key)
+
     def is_qpa(self):
-        return Config.objects.get(key="qpa_hack").value == "qpa"
+        return self.get_cached("qpa_hack").value == "qpa"
 
     def config_name(self):
-        return Config.objects.get(key="qpa_hack")
+        return self.get_cached("qpa_hack")
 
     def stage_tasks(self):
-        return Config.objects.get(key="stage_tasks").get_int()
+        return self.get_cached("stage_tasks").get_int()
 
     def registration_disabled(self):
-        return Config.objects.get(key="disable_registration").get_bool()
+        return self.get_cached("disable_registration").get_bool()
 
     def wargame_active(self):
-        return Config.objects.get(key="wargame_active").get_bool()
+        return self.get_cached("wargame_active").get_bool()
 
     def show_qpa_points(self):
-        return Config.objects.get(key="show_qpa_points").get_bool()
+        return self.get_cached("show_qpa_points").get_bool()
 
     def qpa_points_multiplier(self):
-        return Config.objects.get(key="qpa_points_multiplier").get_float()
+        return self.get_cached("qpa_points_multiplier").get_float()
 
     def email_required(self):
-        return Config.objects.get(key="email_required").get_bool()
+        return self.get_cached("email_required").get_bool()
 
     def private_scoreboard(self):
-        return Config.objects.get(key="private_scoreboard").get_bool()
+        return self.get_cached("private_scoreboard").get_bool()
+
+    def dynamic_scoring(self):
+        return self.get_cached("scoring_mode").value == "dynamic"
+
+    def dynamic_minimum_ratio(self):
+        return self.get_cached("dynamic_minimum_ratio").get_float()
+
+    def dynamic_decay(self):
+        return self.get_cached("dynamic_decay").get_int()
+
+    def throttle_rate(self):
+        return self.get_cached("throttle_rate").get_float()
+
+    def throttle_burst(self):
+        return self.get_cached("throttle_burst").get_int()
+
+    def throttle_ip_rate(self):
+        return self.get_cached("throttle_ip_rate").get_float()
 
 
 class Config(Model):
@@ -46,6 +138,10 @@ class Config(Model):
     possible_values = CharField(max_length=500, blank=True, default="")
     objects = ConfigManager()
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_config_version()
+
     def get_int(self):
         return int(self.value)
 
@@ -71,11 +167,30 @@ class ChallengeFileChunkedUpload(ChunkedUpload):
     pass
 
 
+STATIC_CONTENT_CACHE_KEY = "wargame_admin:static_content:{}"
+
+
+class StaticContentManager(Manager):
+    def get_html(self, key):
+        cache_key = STATIC_CONTENT_CACHE_KEY.format(key)
+        html = cache.get(cache_key)
+        if html is None:
+            html = self.get(key=key).html
+            cache.set(cache_key, html, None)
+        return html
+
+
 class StaticContent(Model):
     key = CharField(max_length=255, primary_key=True)
     display_name = CharField(max_length=255)
     note = CharField(max_length=255, default="")
     html = TextField()
+    objects = StaticContentManager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        cache_key = STATIC_CONTENT_CACHE_KEY.format(self.key)
+        transaction.on_commit(lambda: cache.delete(cache_key))
 
 
 class Export(Model):
@@ -85,9 +200,99 @@ class Export(Model):
     status = models.CharField(max_length=20, choices=EXPORT_STATUS, default="IN_PROGRESS")
 
 
-# Deletes file from filesystem when File object is deleted.
+# Deletes the file of the export in the background when it is deleted
 @receiver(signals.post_delete, sender=Export)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     if instance.file:
-        if os.path.isfile(instance.file.path):
-            os.remove(instance.file.path)
+        MediaTombstone.delete_later(instance.file.name)
+
+
+SWEEP_DELAY = 2
+SWEEP_BATCH_SIZE = 500
+SWEEP_PENDING_KEY = "wargame_admin:media:sweep-pending"
+SWEEP_LOCK_KEY = "wargame_admin:media:sweep-lock"
+SWEEP_LOCK_TIMEOUT = 60
+# Key of the PostgreSQL advisory lock held by the sweep and by the transactions writing rows which refer to stored files
+MEDIA_LOCK_ID = 4107
+
+
+class MediaTombstone(Model):
+    """
+    A file of the media directory to be deleted. Deleting a row with a file records a tombstone in the same transaction,
+    and the file is deleted by a background sweep after the transaction is committed, so requests and imports don't
+    wait for the file system. The file is kept if a row refers to it again (challenge files are shared by their
+    content), and the tombstones of files that could not be deleted are retried by the next sweep.
+    """
+
+    name = CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def delete_later(name):
+        MediaTombstone.objects.create(name=name)
+        transaction.on_commit(schedule_sweep)
+
+    @staticmethod
+    def lock(shared=False):
+        """
+        Locks the media files until the end of the transaction. Rows referring to a stored file which may be shared
+        take a shared lock before checking that the file exists, and the sweep takes it exclusively, so it can't delete
+        the file before the row is committed. SQLite (used in development) has no such lock.
+        """
+        if connection.vendor == "postgresql":
+            function = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT {function}(%s)", [MEDIA_LOCK_ID])
+
+    @staticmethod
+    def file_fields():
+        for model in apps.get_models():
+            # Inherited fields are queried through the model declaring them
+            for field in model._meta.local_concrete_fields:
+                if isinstance(field, models.FileField):
+                    yield model, field
+
+    @staticmethod
+    def referenced(names):
+        """The names of the media files that are still referred to by a file field of any model."""
+        found = set()
+        for model, field in MediaTombstone.file_fields():
+            found.update(model.objects.filter(**{f"{field.name}__in": names}).values_list(field.name, flat=True))
+        return found
+
+    @staticmethod
+    def sweep():
+        """Deletes the files of the tombstones, returns the number of deleted files."""
+        if not cache.add(SWEEP_LOCK_KEY, True, SWEEP_LOCK_TIMEOUT):
+            return 0
+        deleted = 0
+        try:
+            last_id = 0
+            while True:
+                with transaction.atomic():
+                    # Waits for the rows being written to refer to the files, they are committed when they are checked
+                    MediaTombstone.lock()
+                    tombstones = list(MediaTombstone.objects.filter(id__gt=last_id).order_by("id")[:SWEEP_BATCH_SIZE])
+                    if not tombstones:
+                        return deleted
+                    last_id = tombstones[-1].id
+
+                    referenced = MediaTombstone.referenced({tombstone.name for tombstone in tombstones})
+                    swept = []
+                    for tombstone in tombstones:
+                        if tombstone.name not in referenced:
+                            try:
+                                # Every file field of the project stores its files in the media directory
+                                default_storage.delete(tombstone.name)
+                            except OSError:
+                                continue
+                            deleted += 1
+                        swept.append(tombstone.id)
+                    MediaTombstone.objects.filter(id__in=swept).delete()
+        finally:
+            cache.delete(SWEEP_LOCK_KEY)
+
+
+def schedule_sweep():
+    # Deletes within SWEEP_DELAY seconds (e.g. the files of a deleted challenge) are swept together
+    jobs.schedule_once(SWEEP_PENDING_KEY, SWEEP_DELAY, MediaTombstone.sweep)
@@ -1,4 +1,5 @@
 import os
+import time
 from abc import ABCMeta, abstractmethod
 from shutil import copyfile
 from threading import Thread
@@ -8,6 +9,7 @@ from chunked_upload.exceptions import ChunkedUploadError
 from chunked_upload.views import ChunkedUploadView, ChunkedUploadCompleteView
 from django.contrib import messages
 from django.core.paginator import Paginator
+from django.db import transaction
 from django.forms import inlineformset_factory, formset_factory, modelformset_factory
 from django.http import HttpResponseRedirect, HttpResponseBadRequest, HttpResponseNotFound
 from django.shortcuts import render
@@ -19,7 +21,10 @@ from utils.challenge_import import do_challenge_import
 from utils.export_challenges import export_challenges
 from utils.serve_file import serve_file
 from utils.user_import import do_user_import
-from wargame.models import Challenge, File, UserChallenge, User, StaffMember
+from wargame import bundles
+from wargame.models import Challenge, File, UserChallenge, User, StaffMember, UserScore
+from wargame.scoreboard import rebuild_scoreboard
+from wargame.throttling import throttled_counts, throttled_total
 from wargame_admin.filters import UserFilter
 from wargame_admin.forms import (
     ChallengeForm,
@@ -31,7 +36,7 @@ from wargame_admin.forms import (
     StaticContentForm,
     RebalanceChallengeForm,
 )
-from wargame_admin.models import Config, ChallengeFileChunkedUpload, StaticContent, Export
+from wargame_admin.models import Config, ChallengeFileChunkedUpload, StaticContent, Export, bump_config_version
 from wargame_web.settings import base
 
 
@@ -61,6 +66,17 @@ class ChallengeEditView(UpdateView):
     model = Challenge
     form_class = ChallengeForm
 
+    @transaction.atomic
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # Flag, points and visibility changes affect the score of everyone who attempted the challenge
+        self.object.update_submission_correctness()
+        Challenge.update_solve_counts([self.object.id])
+        user_ids = self.object.userchallenge_set.values("user_id")
+        UserScore.recalculate(user_ids)
+        rebuild_scoreboard()
+        return response
+
     def get_success_url(self):
         messages.success(self.request, "Challenge saved.")
         return reverse_lazy("wargame-admin:challenge-details", kwargs={"pk": self.object.id})
@@ -80,6 +96,14 @@ class ChallengeDeleteView(DeleteView):
     template_name = "wargame_admin/challenge_delete.html"
     model = Challenge
 
+    @transaction.atomic
+    def delete(self, request, *args, **kwargs):
+        user_ids = list(self.get_object().userchallenge_set.values_list("user_id", flat=True))
+        response = super().delete(request, *args, **kwargs)
+        UserScore.recalculate(user_ids)
+        rebuild_scoreboard()
+        return response
+
     def get_success_url(self):
         messages.success(self.request, "Challenge deleted.")
         return reverse_lazy("wargame-admin:challenges")
@@ -103,6 +127,7 @@ class ChallengeFilesView(TemplateView):
         formset = self.file_form_set(request.POST, request.FILES, instance=self.challenge())
         if formset.is_valid():
             formset.save()
+            bundles.schedule_build(self.kwargs["pk"])
             messages.success(self.request, "Files saved.")
 
         return HttpResponseRedirect(self.request.path_info)  # Redirect to the same page
@@ -112,6 +137,11 @@ class ChallengeFileDeleteView(DeleteView):
     template_name = "wargame_admin/challenge_file_delete.html"
     model = File
 
+    def delete(self, request, *args, **kwargs):
+        response = super().delete(request, *args, **kwargs)
+        bundles.schedule_build(self.object.challenge_id)
+        return response
+
     def get_success_url(self):
         messages.success(self.request, "File deleted.")
         return reverse_lazy("wargame-admin:challenge-files", kwargs={"pk": self.object.challenge.id})
@@ -125,8 +155,15 @@ class UserAdminView(TemplateView):
         return UserFilter(self.request.GET, queryset=User.objects.order_by("-is_staff").all())
 
     def users(self):
-        page = self.request.GET.get("page", 1)
-        return Paginator(self.filter().qs, 25).get_page(page)
+        page = Paginator(self.filter().qs, 25).get_page(self.request.GET.get("page", 1))
+        counts = throttled_counts([user.id for user in page])
+        for user in page:
+            user.throttled = counts[user.id]
+        return page
+
+    # noinspection PyMethodMayBeStatic
+    def throttled_total(self):
+        return throttled_total()
 
 
 class SubmissionsView(TemplateView, metaclass=ABCMeta):
@@ -254,12 +291,24 @@ class SubmissionActionView(TemplateView, metaclass=ABCMeta):
         pass
 
     def post(self, request, *args, **kwargs):
-        for userchallenge in self.userchallenges():
-            self.do_action(userchallenge)
-            if not userchallenge.hint_used and not userchallenge.submission_set.exists():
-                userchallenge.delete()
-            else:
-                userchallenge.save()
+        with transaction.atomic():
+            user_ids = set()
+            challenge_ids = set()
+            for userchallenge in self.userchallenges():
+                self.do_action(userchallenge)
+                user_ids.add(userchallenge.user_id)
+                challenge_ids.add(userchallenge.challenge_id)
+                if not userchallenge.hint_used and not userchallenge.submission_set.exists():
+                    userchallenge.delete()
+                else:
+                    userchallenge.save()
+            # Removed solves change the value of the challenge for every solver with dynamic scoring
+            Challenge.update_solve_counts(challenge_ids)
+            user_ids.update(
+                UserChallenge.objects.filter(challenge_id__in=challenge_ids).values_list("user_id", flat=True)
+            )
+            UserScore.recalculate(user_ids)
+            rebuild_scoreboard()
         return HttpResponseRedirect(self.return_url())
 
 
@@ -295,21 +344,35 @@ class UserEdit(UpdateView):
 
 class ConfigEditorView(TemplateView):
     template_name = "wargame_admin/config_editor.html"
+    # The scores, solve counts and progress are only updated incrementally in the current mode (qpa_hack)
+    scoring_keys = ("qpa_hack", "scoring_mode", "dynamic_minimum_ratio", "dynamic_decay")
 
     # noinspection PyMethodMayBeStatic
     def configs(self):
         return Config.objects.all()
 
     def post(self, request, *args, **kwargs):
-        for key, value in request.POST.dict().items():
-            if key == "csrfmiddlewaretoken":
-                continue
-            config = Config.objects.get(key=key)
-            config.value = value
-            config.save()
+        snapshot = Config.objects.snapshot()
+        with transaction.atomic():
+            changed = []
+            for key, value in request.POST.dict().items():
+                if key == "csrfmiddlewaretoken" or snapshot.get(key).value == value:
+                    continue
+                Config.objects.filter(key=key).update(value=value)
+                changed.append(key)
+            bump_config_version()
+
+            if any(key in self.scoring_keys for key in changed):
+                # Runs after the config snapshot is reloaded with the new scoring settings
+                transaction.on_commit(self.rescore)
         messages.success(self.request, "Configuration saved.")
         return HttpResponseRedirect(self.request.path_info)
 
+    @staticmethod
+    def rescore():
+        UserScore.recalculate()
+        rebuild_scoreboard()
+
 
 class StaffMemberAdmin(TemplateView):
     template_name = "wargame_admin/staff_admin.html"
@@ -446,6 +509,7 @@ class ChallengeFileChunkedUploadCompleteView(ChunkedUploadCompleteView):
             file.challenge_id = self.kwargs["challenge_id"]
             file.filename = uploaded_file.name
             file.save()
+            bundles.schedule_build(file.challenge_id)
             messages.success(request, "File uploaded.")
         else:
             messages.error(request, "Error uploading file:" + form.errors)
@@ -483,7 +547,29 @@ class RebalanceView(TemplateView):
     def post(self, request, *args, **kwargs):
         formset = self.RebalanceChallengeFormset(request.POST, request.FILES, queryset=self.queryset())
         if formset.is_valid():
-            formset.save()
-            messages.success(self.request, "Challenges saved")
+            started = time.monotonic()
+            with transaction.atomic():
+                # Only the forms whose values differ from the stored ones are returned
+                challenges = formset.save(commit=False)
+                Challenge.objects.bulk_update(challenges, ["level", "points"])
+                Challenge.invalidate_catalog()
+
+                # Points change the score, and levels the unlocked level of everyone who solved the challenge
+                rescored = [
+                    challenge.id
+                    for challenge, fields in formset.changed_objects
+                    if "points" in fields or "level" in fields
+                ]
+                user_ids = list(
+                    UserChallenge.objects.filter(challenge_id__in=rescored).values_list("user_id", flat=True).distinct()
+                )
+                if user_ids:
+                    UserScore.recalculate(user_ids)
+                    rebuild_scoreboard()
+            elapsed = (time.monotonic() - started) * 1000
+            messages.success(
+                self.request,
+                f"{len(challenges)} challenges saved, {len(user_ids)} users re-scored in {elapsed:.0f} ms",
+            )
 
         return HttpResponseRedirect(self.request.path_info)  # Redirect to the same page
@@ -0,0 +1,52 @@
+"""
+The thread pool of the async views. The event loop holds any number of waiting requests, while their synchronous work
+(database queries and template rendering) runs on at most ASYNC_VIEW_THREADS threads, so the number of threads and
+database connections of a process stays capped however many clients are connected.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+import wargame_web.settings.base as settings
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEW_THREADS, thread_name_prefix="async-view")
+
+
+def run_job(fn, args, kwargs):
+    # The connection of the thread is kept between the jobs, unless it is broken or older than CONN_MAX_AGE, like the
+    # request handler does between the requests
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(fn, *args, **kwargs):
+    """Runs fn in the pool, waiting for a free thread without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(run_job, fn, args, kwargs))
+
+
+def render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    # The handler would render the templates, and evaluate the querysets in them, on its single thread
+    if hasattr(response, "render") and callable(response.render):
+        response.render()
+    return response
+
+
+def async_view(view):
+    """The async view running the given synchronous view (e.g. a class-based view) in the pool."""
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if isinstance(request, ASGIRequest):
+            return await run_sync(render_view, view, request, *args, **kwargs)
+        # The WSGI handler (and the test client) already holds a thread for the request, which runs the view
+        return await sync_to_async(render_view, thread_sensitive=True)(view, request, *args, **kwargs)
+
+    return wrapper
@@ -1,17 +1,29 @@
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse_lazy
 from django.contrib import messages
+from django.utils.deprecation import MiddlewareMixin
 from django.utils.safestring import mark_safe
 
 from wargame_admin.models import Config, StaticContent
+from wargame_web.executor import run_sync
 
 
-class DisableSiteMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class ExecutorMiddlewareMixin(MiddlewareMixin):
+    """
+    Middleware working with both sync and async views. Under the async handler, process_request runs in the pool of
+    the async views, instead of the single thread the handler runs the synchronous middlewares in.
+    """
 
-    def __call__(self, request):
+    async def __acall__(self, request):
+        response = await run_sync(self.process_request, request)
+        return response or await self.get_response(request)
+
+
+class DisableSiteMiddleware(ExecutorMiddlewareMixin):
+    def process_request(self, request):
         if not Config.objects.wargame_active():
+            if request.path.startswith("/api/challenges"):
+                return JsonResponse({"error": "The wargame is not running"}, status=403)
             if request.path.startswith("/challenges") or (
                 request.path.startswith("/challenge-files") and not request.user.is_staff
             ):
@@ -19,31 +31,30 @@ class DisableSiteMiddleware:
                 messages.warning(request, "The wargame is not running, you can't view the challenges.")
                 return HttpResponseRedirect(reverse_lazy("scoreboard"))
 
-        return self.get_response(request)
-
+        return None
 
-class RequireEmailMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
 
-    def __call__(self, request):
+class RequireEmailMiddleware(ExecutorMiddlewareMixin):
+    def process_request(self, request):
         if (
             Config.objects.email_required()
+            and not request.path.startswith("/user/set-email")
+            # Signed file downloads do not load the user
+            and not request.path.startswith("/challenge-files/signed")
             and request.user.is_authenticated
             and not request.user.email
-            and not request.path.startswith("/user/set-email")
         ):
 
-            text = StaticContent.objects.get(key="email_notification").html
+            text = StaticContent.objects.get_html("email_notification")
 
             storage = messages.get_messages(request)
             for message in storage:
                 if message.message == text:
                     storage.used = False
-                    return self.get_response(request)
+                    return None
 
             storage.used = False
 
             messages.warning(request, mark_safe(text))
 
-        return self.get_response(request)
+        return None
@@ -1,10 +1,47 @@
+import asyncio
+
 from channels.auth import AuthMiddlewareStack
+from channels.http import AsgiHandler
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
-from django.urls import path
+from django.core.asgi import get_asgi_application
+from django.urls import path, resolve, Resolver404
 
+from wargame.consumers import ScoreboardConsumer
 from wargame_admin.consumers import LogConsumer
 
+
+class HttpRouter:
+    """
+    Serves the async views with the ASGI handler of Django, through the ASGI 2 interface of channels 2. The other views
+    keep the synchronous handler of channels, which runs them in its thread pool, since the handler of Django would run
+    them one at a time on its single thread.
+    """
+
+    def __init__(self):
+        self.async_handler = get_asgi_application()
+
+    def __call__(self, scope):
+        try:
+            view = resolve(scope["path"]).func
+        except Resolver404:
+            view = None
+        if not asyncio.iscoroutinefunction(view):
+            return AsgiHandler(scope)
+
+        async def instance(receive, send):
+            await self.async_handler(scope, receive, send)
+
+        return instance
+
+
 application = ProtocolTypeRouter(
-    {"websocket": AllowedHostsOriginValidator(AuthMiddlewareStack(URLRouter([path("ws/log/<log_var>/", LogConsumer)])))}
+    {
+        "http": HttpRouter(),
+        "websocket": AllowedHostsOriginValidator(
+            AuthMiddlewareStack(
+                URLRouter([path("ws/log/<log_var>/", LogConsumer), path("ws/scoreboard/", ScoreboardConsumer)])
+            )
+        ),
+    }
 )
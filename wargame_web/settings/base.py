@@ -7,11 +7,15 @@ with open(os.getenv("CONFIG_FILE", "config.yaml"), "r") as f:
     YAML_SETTINGS = yaml.safe_load(f)
 
 DEBUG = YAML_SETTINGS.get("debug")
+# Downloads are served by nginx unless disabled, otherwise by Django
+X_ACCEL_REDIRECT = YAML_SETTINGS.get("x_accel_redirect", not DEBUG)
 SECRET_KEY = YAML_SETTINGS.get("secret_key")
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 ALLOWED_HOSTS = YAML_SETTINGS.get("allowed_hosts")
+# Threads of each process running the database work of the async views, each of them holds one database connection
+ASYNC_VIEW_THREADS = YAML_SETTINGS.get("async_view_threads", 8)
 
 
 ASGI_APPLICATION = "wargame_web.routing.application"
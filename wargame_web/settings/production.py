@@ -11,6 +11,9 @@ DATABASES = {
     }
 }
 
+# Shared between the worker processes, used for invalidating the in-process caches
+CACHES = {"default": {"BACKEND": "django_redis.cache.RedisCache", "LOCATION": "redis://127.0.0.1:6379/1"}}
+
 X_FRAME_OPTIONS = "DENY"
 CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True